@@ -0,0 +1,155 @@
+"""
+Checks report delivery against a local stand-in for a Discord webhook, which
+answers slowly and throttles every few requests with `429` and
+`Retry-After`. Compares posting every report synchronously, one request each,
+with the background dispatcher, and verifies that all the reports arrived
+in order, within the message size limit and over reused connections.
+
+Usage: python3 scripts/benchmark_delivery.py [<n_reports>] [<latency_seconds>]
+"""
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import sys
+import threading
+import time
+from typing import List
+
+import requests
+
+from shape_challenge.delivery import (
+    DISCORD_MAX_MESSAGE_SIZE,
+    ReportDispatcher,
+    WebhookSink,
+)
+
+
+class StandIn:
+    """
+    Local webhook that records the messages it receives. Every
+    `throttle_every`-th request is answered with `429` and a `Retry-After`.
+    """
+
+    def __init__(self, latency: float, throttle_every: int = 4, retry_after: float = 0.2):
+        self.messages: List[str] = []
+        self.connections = set()
+        self.requests = 0
+        self.throttled = 0
+        lock = threading.Lock()
+        stand_in = self
+
+        class Handler(BaseHTTPRequestHandler):
+            """
+            Handles webhook requests.
+            """
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(self):  # pylint: disable=invalid-name
+                """
+                Records the message, or throttles the request.
+                """
+                body = self.rfile.read(int(self.headers["Content-Length"]))
+                time.sleep(latency)
+                with lock:
+                    stand_in.requests += 1
+                    stand_in.connections.add(self.client_address)
+                    throttle = stand_in.requests % throttle_every == 0
+                    if throttle:
+                        stand_in.throttled += 1
+                    else:
+                        stand_in.messages.append(json.loads(body)["content"])
+                if throttle:
+                    content = json.dumps({"retry_after": retry_after}).encode("utf-8")
+                    self.send_response(429)
+                    self.send_header("Retry-After", str(retry_after))
+                else:
+                    content = b""
+                    self.send_response(204)
+                self.send_header("Content-Length", str(len(content)))
+                self.end_headers()
+                self.wfile.write(content)
+
+            def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}/webhook"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        """
+        Stops the stand-in.
+        """
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def make_report(number: int) -> str:
+    """
+    Builds a report with the same shape as `generate_report`'s.
+    """
+    lines = [f"Report #{number}", "", "Total equipment failures: 11645",
+             "Equipment code with most failures: E1AD07D4", "",
+             "Average failures across equipment groups:"]
+    lines += [f"    GROUP{group:03d}: {1000 + 37 * group + number:.2f}" for group in range(8)]
+    return "\n".join(lines)
+
+
+def check(reports: List[str], stand_in: StandIn) -> None:
+    """
+    Checks that all the reports arrived, in order and within the size limit.
+    """
+    too_long = [m for m in stand_in.messages if len(m) > DISCORD_MAX_MESSAGE_SIZE]
+    received = "\n\n".join(m.strip("`") for m in stand_in.messages)
+    print(f"    {stand_in.requests} requests, {stand_in.throttled} throttled, "
+          f"{len(stand_in.messages)} messages, {len(stand_in.connections)} connections")
+    assert not too_long, f"{len(too_long)} messages over {DISCORD_MAX_MESSAGE_SIZE} characters"
+    assert received == "\n\n".join(reports), "Reports were lost or reordered"
+
+
+def main(n_reports: int, latency: float) -> None:
+    """
+    Runs the comparison.
+    """
+    reports = [make_report(number) for number in range(n_reports)]
+    print(f"Delivering {n_reports} reports to a stand-in with {latency}s of latency")
+
+    stand_in = StandIn(latency, throttle_every=n_reports + 1)
+    start = time.perf_counter()
+    for report in reports:
+        requests.post(stand_in.url, json={"content": f"```{report}```"})
+    blocked = time.perf_counter() - start
+    print(f"Synchronous, one request per report: blocked for {blocked:.3f}s")
+    check(reports, stand_in)
+    stand_in.close()
+
+    stand_in = StandIn(latency)
+    dispatcher = ReportDispatcher([WebhookSink(stand_in.url)], timeout=30.0)
+    start = time.perf_counter()
+    for report in reports:
+        dispatcher.submit(report)
+    blocked = time.perf_counter() - start
+    drained = dispatcher.close()
+    total = time.perf_counter() - start
+    print(f"Dispatcher, batched, with 429s: blocked for {blocked:.3f}s, "
+          f"delivered in {total:.3f}s (drained: {drained})")
+    check(reports, stand_in)
+    assert dispatcher.failed == 0 and dispatcher.delivered == n_reports
+    stand_in.close()
+
+    stand_in = StandIn(latency, throttle_every=1, retry_after=1.0)
+    dispatcher = ReportDispatcher([WebhookSink(stand_in.url)], timeout=1.5)
+    dispatcher.submit(reports[0])
+    drained = dispatcher.close()
+    print(f"Always throttled, 1.5s timeout: drained: {drained}, "
+          f"failed: {dispatcher.failed}, requests: {stand_in.requests}")
+    assert dispatcher.failed == 1
+    stand_in.close()
+
+
+if __name__ == "__main__":
+    main(
+        int(sys.argv[1]) if len(sys.argv) > 1 else 50,
+        float(sys.argv[2]) if len(sys.argv) > 2 else 0.05,
+    )
@@ -0,0 +1,54 @@
+"""
+Compares the wall-clock time of the data flow, i.e. its critical path, under
+the sequential, threads and processes executors on a synthetic dataset with
+rotated failure logs. The processes executor is also run with a handoff
+directory (see `shape_challenge.handoff`).
+
+Usage: python3 scripts/benchmark_executors.py [<n_failures>] [<n_files>]
+"""
+
+import os
+from pathlib import Path
+import sys
+import tempfile
+import time
+
+from generate_synthetic_data import generate
+from shape_challenge.executors import get_executor
+from shape_challenge.flows import flow
+
+if __name__ == "__main__":
+    n_failures = int(sys.argv[1]) if len(sys.argv) > 1 else 2_000_000
+    n_files = int(sys.argv[2]) if len(sys.argv) > 2 else 16
+
+    with tempfile.TemporaryDirectory() as directory:
+        parameters = generate(directory, n_failures, n_files=n_files)
+        parameters.update({
+            "Start date": "2020-01-01",
+            "End date": "2020-01-31",
+            "Output report file path": str(Path(directory) / "report.txt"),
+        })
+
+        # Process-based executors pickle the dataframes on every edge, so
+        # they're also measured with the dataframes handed off instead
+        handoff_directory = str(Path(directory) / "handoff")
+        runs = {
+            "sequential": ("sequential", None),
+            "threads": ("threads", None),
+            "processes": ("processes", None),
+            "processes + handoff": ("processes", handoff_directory),
+        }
+
+        timings = {}
+        for name, (scheduler, handoff) in runs.items():
+            start = time.perf_counter()
+            state = flow.run(parameters={**parameters, "Handoff directory": handoff},
+                             executor=get_executor(scheduler))
+            timings[name] = time.perf_counter() - start
+            if not state.is_successful():
+                raise RuntimeError(f"Flow run failed with the {name} executor")
+
+        print(f"{n_failures} failures in {n_files} files, {os.cpu_count()} CPUs:")
+        for name, elapsed in timings.items():
+            print(f"\t{name}: {elapsed:.2f}s "
+                  f"({timings['sequential'] / elapsed:.2f}x speedup)")
@@ -0,0 +1,146 @@
+"""
+Compares passing a merged dataframe between tasks by pickling it (what
+parallel and process-based executors do on each edge of the flow) with
+handing it off through memory-mapped column files. Reports serialization
+time, payload size, the size of the handoff files (in shared memory, with
+the default directory) and the peak memory of a downstream task that
+receives the dataframe and counts failures per equipment code.
+
+Both are measured with all columns, which is what a task receives from the
+executor, and projected on the two columns the downstream task uses, which
+the producer has to select for pickling but the consumer can select for the
+handoff.
+
+The downstream task runs in a fresh process, like an executor's worker, and
+its peak memory is its peak resident set size (Linux only) above what it used before
+receiving the payload. This includes the memory-mapped pages it reads.
+
+Usage: python3 scripts/benchmark_handoff.py [<n_rows>] [<handoff_directory>]
+"""
+
+from functools import partial
+import multiprocessing
+import pickle
+import sys
+import time
+from typing import Sequence
+
+import numpy as np
+import pandas as pd
+
+from shape_challenge.constants import Constants as constants
+from shape_challenge.handoff import FrameHandle, put_frame, release_frame, resolve_frame
+
+# Columns used by the downstream task
+DOWNSTREAM_COLUMNS = ["equipment_code", "sensor_id"]
+
+
+def make_merged_data(n_rows: int) -> pd.DataFrame:
+    """
+    Builds a dataframe with the same columns as the merged data.
+    """
+    rng = np.random.default_rng(0)
+    equipment_ids = rng.integers(1, 10_001, n_rows)
+    return pd.DataFrame({
+        "timestamp": pd.Timestamp("2020-01-01") + pd.to_timedelta(
+            np.sort(rng.integers(0, 31 * 24 * 3600, n_rows)), unit="s"),
+        "sensor_id": equipment_ids * 10 + rng.integers(0, 10, n_rows),
+        "temperature": rng.normal(300, 50, n_rows),
+        "vibration": rng.normal(0, 5000, n_rows),
+        "equipment_id": equipment_ids,
+        "equipment_code": pd.Series(equipment_ids).map("{:08X}".format),
+        "equipment_group_name": pd.Series(equipment_ids % 20).map("GROUP{:03d}".format),
+    })
+
+
+def downstream(dataframe: pd.DataFrame) -> str:
+    """
+    Same work as `get_most_failures_equipment_code`.
+    """
+    return dataframe.groupby("equipment_code", observed=True).count()["sensor_id"].idxmax()
+
+
+def max_rss() -> int:
+    """
+    Peak resident set size of this process, in bytes. Reads `VmHWM`, as
+    `ru_maxrss` keeps the parent's peak across the exec of a spawned process.
+    """
+    with open("/proc/self/status", encoding="utf-8") as status:
+        for line in status:
+            if line.startswith("VmHWM:"):
+                return int(line.split()[1]) * 1024
+    raise RuntimeError("VmHWM not found in /proc/self/status")
+
+
+def consume(connection, receive) -> None:
+    """
+    Consumer side, run in a fresh process: receives the payload, then
+    `receive` followed by the downstream work.
+    """
+    baseline = max_rss()
+    payload = connection.recv()
+    start = time.perf_counter()
+    result = downstream(receive(payload))
+    elapsed = time.perf_counter() - start
+    connection.send((result, elapsed, max_rss() - baseline))
+
+
+def unpickle(payload: bytes) -> pd.DataFrame:
+    """
+    Receives a pickled dataframe.
+    """
+    return pickle.loads(payload)
+
+
+def resolve(handle: FrameHandle, columns: Sequence[str] = None) -> pd.DataFrame:
+    """
+    Receives a handed off dataframe, mapping only `columns` if given.
+    """
+    return resolve_frame(handle, columns=columns)
+
+
+def measure(name: str, send, receive, footprint) -> None:
+    """
+    Times `send` (producer side), then measures time and peak memory of
+    `receive` followed by the downstream work (consumer side) in a child
+    process. `footprint` gives the bytes the payload takes outside of the
+    processes, e.g. in `/dev/shm`.
+    """
+    start = time.perf_counter()
+    payload = send()
+    send_time = time.perf_counter() - start
+
+    context = multiprocessing.get_context("spawn")
+    parent_connection, child_connection = context.Pipe()
+    process = context.Process(target=consume, args=(child_connection, receive))
+    process.start()
+    parent_connection.send(payload)
+    result, receive_time, peak = parent_connection.recv()
+    process.join()
+
+    print(f"{name}:")
+    print(f"\tsend: {send_time:.2f}s, payload: {len(pickle.dumps(payload)) / 2**20:.1f}MiB, "
+          f"files: {footprint(payload) / 2**20:.1f}MiB")
+    print(f"\treceive + downstream: {receive_time:.2f}s, "
+          f"peak memory: {peak / 2**20:.1f}MiB")
+    print(f"\tresult: {result}")
+
+
+if __name__ == "__main__":
+    n_rows = int(sys.argv[1]) if len(sys.argv) > 1 else 10_000_000
+    directory = sys.argv[2] if len(sys.argv) > 2 else constants.HANDOFF_DIRECTORY.value
+
+    dataframe = make_merged_data(n_rows)
+    print(f"{n_rows} rows, {dataframe.memory_usage(deep=True).sum() / 2**20:.1f}MiB in memory")
+
+    handles = []
+    for label, projection in (("all columns", None), ("downstream columns", DOWNSTREAM_COLUMNS)):
+        sent = dataframe if projection is None else dataframe[projection]
+        measure(f"Pickle, {label}",
+                lambda sent=sent: pickle.dumps(sent, protocol=pickle.HIGHEST_PROTOCOL),
+                unpickle, lambda payload: 0)
+        # The whole dataframe is handed off, the consumer maps what it needs
+        measure(f"Handoff, {label}",
+                lambda: handles.append(put_frame(dataframe, directory)) or handles[-1],
+                partial(resolve, columns=projection), lambda handle: handle.nbytes)
+        release_frame(handles[-1])
@@ -0,0 +1,71 @@
+"""
+Measures latency and throughput of the report server under concurrent load,
+first with a cold cache (every range is new) and then with a warm one.
+
+Usage: python3 scripts/benchmark_report_server.py [<n_failures>] [<n_clients>]
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+import sys
+import tempfile
+import threading
+import time
+from urllib.request import urlopen
+
+import numpy as np
+import pandas as pd
+
+from generate_synthetic_data import generate
+from shape_challenge.server import create_server
+
+
+def run_queries(base_url: str, ranges: list, n_clients: int) -> None:
+    """
+    Runs the queries with `n_clients` concurrent clients and prints
+    latency percentiles and throughput.
+    """
+    def query(date_range):
+        start = time.perf_counter()
+        with urlopen(f"{base_url}/report?start={date_range[0]}&end={date_range[1]}") as response:
+            response.read()
+        return time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(n_clients) as executor:
+        latencies = np.array(list(executor.map(query, ranges)))
+    elapsed = time.perf_counter() - start
+    print(f"\t{len(ranges)} queries in {elapsed:.2f}s "
+          f"({len(ranges) / elapsed:.1f} queries/s)")
+    for percentile in (50, 95, 99):
+        print(f"\tp{percentile} latency: "
+              f"{np.percentile(latencies, percentile) * 1000:.1f}ms")
+
+
+if __name__ == "__main__":
+    n_failures = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    n_clients = int(sys.argv[2]) if len(sys.argv) > 2 else 16
+
+    with tempfile.TemporaryDirectory() as directory:
+        parameters = generate(directory, n_failures)
+        load_start = time.perf_counter()
+        server = create_server(
+            failure_logs_path=parameters["Failure logs URL or path"],
+            equipment_path=parameters["Equipment data URL or path"],
+            equipment_sensors_path=parameters["Equipment-sensors relationship URL or path"],
+            port=0,
+            cache_size=256,
+            refresh_interval=None,
+        )
+        print(f"Loaded {n_failures} failures in {time.perf_counter() - load_start:.2f}s")
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        url = f"http://127.0.0.1:{server.server_address[1]}"
+
+        days = pd.date_range("2020-01-01", "2020-01-31").strftime("%Y-%m-%d")
+        rng = np.random.default_rng(0)
+        ranges = [tuple(sorted(rng.choice(days, 2))) for _ in range(256)]
+
+        print("Cold cache:")
+        run_queries(url, ranges, n_clients)
+        print("Warm cache:")
+        run_queries(url, ranges, n_clients)
+        server.shutdown()
@@ -0,0 +1,89 @@
+"""
+Generates a synthetic dataset with the same structure as the original data,
+to be used by the benchmark scripts.
+
+Usage: python3 scripts/generate_synthetic_data.py <directory> [<n_failures>]
+"""
+
+import json
+from pathlib import Path
+import sys
+
+import numpy as np
+import pandas as pd
+
+
+# pylint: disable=too-many-arguments
+def generate(
+    directory: str,
+    n_failures: int = 1_000_000,
+    n_equipment: int = 1_000,
+    sensors_per_equipment: int = 10,
+    n_groups: int = 20,
+    start_date: str = "2020-01-01",
+    days: int = 31,
+    seed: int = 0,
+    n_files: int = 1,
+) -> dict:
+    """
+    Writes `equipment.json`, `equipment_sensors.csv` and
+    `equipment_failure_sensors.log` to a directory, with failures sorted
+    by timestamp. If `n_files` is greater than 1, the failure logs are
+    rotated into `logs/equipment_failure_sensors.log.<n>` files instead.
+
+    Returns:
+        A dictionary with the paths of the generated files, keyed by the
+        names of the flow parameters.
+    """
+    rng = np.random.default_rng(seed)
+    path = Path(directory)
+    path.mkdir(parents=True, exist_ok=True)
+
+    # Equipment and sensors
+    groups = [f"GROUP{i:03d}" for i in range(n_groups)]
+    equipment = [
+        {
+            "equipment_id": equipment_id,
+            "code": f"{equipment_id:08X}",
+            "group_name": groups[rng.integers(n_groups)],
+        }
+        for equipment_id in range(1, n_equipment + 1)
+    ]
+    with open(path / "equipment.json", "w", encoding="utf-8") as file:
+        json.dump(equipment, file)
+    n_sensors = n_equipment * sensors_per_equipment
+    pd.DataFrame({
+        "equipment_id": np.repeat(np.arange(1, n_equipment + 1), sensors_per_equipment),
+        "sensor_id": np.arange(1, n_sensors + 1),
+    }).to_csv(path / "equipment_sensors.csv", sep=";", index=False)
+
+    # Failure logs
+    seconds = np.sort(rng.integers(0, days * 24 * 3600, n_failures))
+    timestamps = (pd.Timestamp(start_date) + pd.to_timedelta(seconds, unit="s")
+                  ).strftime("%Y-%m-%d %H:%M:%S")
+    sensors = pd.Series(rng.integers(1, n_sensors + 1, n_failures)).astype(str)
+    temperatures = pd.Series(rng.normal(300, 50, n_failures)).map("{:.2f}".format)
+    vibrations = pd.Series(rng.normal(0, 5000, n_failures)).map("{:.2f}".format)
+    lines = ("[" + pd.Series(timestamps) + "]\tERROR\tsensor[" + sensors
+             + "]:\t(temperature\t" + temperatures + ", vibration\t" + vibrations + ")\n")
+    if n_files == 1:
+        failure_logs_path = path / "equipment_failure_sensors.log"
+        with open(failure_logs_path, "w", encoding="utf-8") as file:
+            file.writelines(lines)
+    else:
+        failure_logs_path = path / "logs"
+        failure_logs_path.mkdir(exist_ok=True)
+        for i, part in enumerate(np.array_split(lines.to_numpy(), n_files)):
+            with open(failure_logs_path / f"equipment_failure_sensors.log.{i:04d}",
+                      "w", encoding="utf-8") as file:
+                file.writelines(part)
+
+    return {
+        "Failure logs URL or path": str(failure_logs_path),
+        "Equipment data URL or path": str(path / "equipment.json"),
+        "Equipment-sensors relationship URL or path": str(path / "equipment_sensors.csv"),
+    }
+
+
+if __name__ == "__main__":
+    generate(sys.argv[1], *[int(arg) for arg in sys.argv[2:3]])
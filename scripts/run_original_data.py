@@ -1,4 +1,5 @@
 from shape_challenge.constants import Constants as constants
+from shape_challenge.executors import get_executor
 from shape_challenge.flows import flow
 
 if __name__ == "__main__":
@@ -10,5 +11,6 @@ if __name__ == "__main__":
             "Start date": constants.SAMPLE_START_DATE.value,
             "End date": constants.SAMPLE_END_DATE.value,
             "Output report file path": constants.LOCAL_OUTPUT_FILE_PATH.value,
-        }
+        },
+        executor=get_executor(constants.EXECUTOR_SCHEDULER.value),
     )
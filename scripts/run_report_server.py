@@ -0,0 +1,11 @@
+from shape_challenge.constants import Constants as constants
+from shape_challenge.server import create_server
+
+if __name__ == "__main__":
+    server = create_server(
+        failure_logs_path=constants.LOCAL_FAILURE_LOGS_PATH.value,
+        equipment_path=constants.LOCAL_EQUIPMENT_PATH.value,
+        equipment_sensors_path=constants.LOCAL_EQUIPMENT_SENSORS_PATH.value,
+        port=constants.REPORT_SERVER_PORT.value,
+    )
+    server.serve_forever()
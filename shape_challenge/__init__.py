@@ -7,14 +7,32 @@ This is a package developed for "Shape's Hard Skill Test - Data Engineer".
 Here, you'll find the following sub-modules:
 
 - `shape_challenge.constants`: Constants used in the package.
+- `shape_challenge.delivery`: Background delivery of the reports to
+    webhooks, local files or the standard output.
+- `shape_challenge.dimensions`: Persisted index of the equipment
+    information (sensor -> equipment -> code and group).
+- `shape_challenge.executors`: Executors for running the data flow
+    sequentially or in parallel.
 - `shape_challenge.flows`: Implementation of the data flow using Prefect.
     The flow is implemented using parameters so we can assure this package
     is reusable.
+- `shape_challenge.handoff`: Handoff of large dataframes between tasks
+    through memory-mapped column files.
 - `shape_challenge.logging`: Logging wrappers for Prefect tasks.
 - `shape_challenge.parsing`: Gather data and clean it a little bit, just
     enough to use it down the road.
+- `shape_challenge.quarantine`: Quarantine for failure log lines that can't
+    be used, with an error budget.
+- `shape_challenge.server`: Long-running report server, with the data kept
+    in memory and an LRU cache of the reports.
+- `shape_challenge.spill`: Memory-budgeted loading of the failure logs,
+    spilling them to disk in partitions when they don't fit.
+- `shape_challenge.statistics`: Online, single-pass and mergeable statistics
+    for the temperature and vibration measurements.
 - `shape_challenge.tasks`: Task definitions for the data flow. This is where
     the actual work is done. (This is where the magic happens.)
+- `shape_challenge.timeseries`: Time-bucketed failure counts per equipment
+    and equipment group.
 - `shape_challenge.transform`: General transformations to the data. Includes
     merging dataframes, filtering and aggregating data.
 
@@ -115,6 +133,127 @@ contain the following information:
 	* Z9K1SAP4: 1116.0
 ```
 
+### Extra - Rotated failure logs
+
+Failure logs don't need to be a single file. The `"Failure logs URL or path"`
+parameter also accepts a directory, a glob pattern or a list of URLs, paths,
+directories and patterns. Each file is parsed by its own task, so a parallel
+executor parses them in parallel (see "Parallel execution" below):
+
+```py
+if __name__ == "__main__":
+    flow.run(
+        parameters={
+            ...
+            "Failure logs URL or path": "./data/logs/equipment_failure_sensors.log.*",
+        }
+    )
+```
+
+### Extra - Dimension index
+
+Parsing large equipment catalogs on every run can be avoided by providing a
+path for the dimension index. The first run builds it from the equipment
+files and saves it there, and later runs reuse it as long as the files
+haven't changed:
+
+```py
+if __name__ == "__main__":
+    flow.run(
+        parameters={
+            ...
+            "Dimension index path": "./data/dimension_index.npz",
+        }
+    )
+```
+
+### Extra - Quarantine for bad lines
+
+By default, a single malformed line in the failure logs (or one with a
+message level other than `ERROR`) aborts the run. If you provide a quarantine
+directory, those lines are written there with their byte offsets and the run
+goes on, unless the error budget is exceeded:
+
+```py
+if __name__ == "__main__":
+    flow.run(
+        parameters={
+            ...
+            "Quarantine directory": "./quarantine",
+            "Max quarantined lines": 1000,
+            "Max quarantined ratio": 0.001,
+        }
+    )
+```
+
+The number of quarantined lines per category is logged at the end of the
+parsing.
+
+### Extra - Parallel execution
+
+Independent tasks in the flow (downloads, parsing of each input and the
+aggregations) can run in parallel. The scripts use a local thread pool,
+configured by `Constants.EXECUTOR_SCHEDULER`, and you can pick any executor
+from `shape_challenge.executors.get_executor`:
+
+```py
+from shape_challenge.executors import get_executor
+
+flow.run(parameters={...}, executor=get_executor("threads", num_workers=4))
+```
+
+Parsing the failure logs is CPU-bound, so with several files the
+`processes` executor is the one that parses them truly in parallel, while
+threads mostly overlap I/O. Processes pickle every dataframe passed between
+tasks, though, so use them with a handoff directory (see below). To compare
+executors on a synthetic dataset, run `python3 scripts/benchmark_executors.py`.
+
+With parallel executors, every dataframe passed between tasks may be copied,
+and with processes, pickled. To avoid it, provide a handoff directory,
+preferably in shared memory (`Constants.HANDOFF_DIRECTORY`): large
+dataframes are then stored there as memory-mapped column files, only
+lightweight handles are passed around, and the files are deleted at the end
+of the flow.
+
+```py
+flow.run(
+    parameters={
+        ...
+        "Handoff directory": constants.HANDOFF_DIRECTORY.value,
+    },
+    executor=get_executor("threads"),
+)
+```
+
+The savings can be measured with `python3 scripts/benchmark_handoff.py`, which
+reports the peak memory of a downstream task in a separate process and the
+size of the handoff files, which count towards the shared memory in use.
+
+### Extra - Memory budget
+
+If the failure logs don't fit in memory, provide a memory budget. When
+loading them in memory is estimated to exceed it, they're parsed in chunks,
+merged and spilled to disk in partitions by equipment instead. The filter
+and report tasks then go through one partition at a time, and the report is
+the same as when everything fits in memory.
+
+```py
+flow.run(
+    parameters={
+        ...
+        "Memory budget (MB)": 512,
+        "Spill directory": "/var/tmp/shape_challenge",
+    },
+)
+```
+
+Spilled partitions are deleted at the end of the flow, or as soon as loading
+the failure logs fails. The measurement statistics are the same too, except
+for the `p50` and `p95` quantiles: they're estimated with a quantile sketch
+(see `shape_challenge.statistics`), within 0.5% of the exact rank either way,
+but as the data is seen in another order when spilling, the estimates can
+differ within that bound.
+
 ### Extra - Discord webhook integration
 
 The implemented flow also has optional Discord webhook integration.
@@ -135,6 +274,108 @@ if __name__ == "__main__":
     )
 ```
 
+The report can also be delivered elsewhere, to any number of webhooks,
+local files or the standard output:
+
+```py
+if __name__ == "__main__":
+    flow.run(
+        parameters={
+            ...
+            "Report delivery sinks": ["stdout", "./reports/delivered.txt"],
+            "Report delivery timeout": 30,
+        }
+    )
+```
+
+Delivery happens in the background (see `shape_challenge.delivery`), so the
+rest of the flow doesn't wait on it. Reports are batched into messages
+within Discord's size limit, connections are reused, rate limits (`429` and
+`Retry-After`) are respected, and reports not delivered within the timeout
+are given up on and logged, without failing the flow. This is tested
+against a local stand-in for a webhook by `python3 -m pytest tests`, and
+`python3 scripts/benchmark_delivery.py` compares it with posting each report
+synchronously.
+
+### Extra - Measurement statistics
+
+The failure logs also carry the temperature and vibration measured by the
+sensor. If you set the `"Include measurement statistics"` parameter to `True`,
+the report gets an extra section with count, mean, standard deviation,
+minimum, approximate quantiles and maximum of both measurements for every
+equipment group:
+
+```py
+if __name__ == "__main__":
+    flow.run(
+        parameters={
+            ...
+            "Include measurement statistics": True,
+        }
+    )
+```
+
+To also get them for every sensor and equipment, provide a directory for
+them, where they're saved as `measurement_statistics_by_<key_column>.csv`:
+
+```py
+if __name__ == "__main__":
+    flow.run(
+        parameters={
+            ...
+            "Include measurement statistics": True,
+            "Measurement statistics output directory": "/path/to/statistics",
+        }
+    )
+```
+
+These are computed by `shape_challenge.statistics` in a single pass with
+bounded memory, and partial results can be merged, so the same engine works
+over chunked or parallel input. Quantiles are approximated with a KLL sketch,
+whose rank error stays within about 0.2% whatever the order of the data.
+
+### Extra - Failure series
+
+Besides the totals in the report, the flow can save failure counts per hour
+(or any other frequency) for every equipment and equipment group, which is
+handy for alerting. Just provide an output directory:
+
+```py
+if __name__ == "__main__":
+    flow.run(
+        parameters={
+            ...
+            "Failure series output directory": "./reports/failure_series",
+            "Failure series frequency": "1h",
+        }
+    )
+```
+
+For each of `equipment_code` and `equipment_group_name`, you'll get a
+`failures_by_<column>_<frequency>.npz` file with the dense matrix of counts
+(`keys` x `bucket_starts`) and a `.csv` file with the non-zero counts in
+long form.
+
+### Extra - Report server
+
+If you need reports for many different date ranges, running the whole flow
+for each of them means loading and merging the data every time. Instead, you
+can start the report server, which loads the data once, picks up new lines
+appended to the failure logs and caches the reports it computes:
+
+```bash
+python3 scripts/run_report_server.py
+```
+
+Then, query it for any date range:
+
+```bash
+curl "http://127.0.0.1:8000/report?start=2020-01-01&end=2020-01-31"
+```
+
+Latency and throughput under concurrent load can be measured on a synthetic
+dataset with `python3 scripts/benchmark_report_server.py`.
+
 ## How this was developed
 
 The initial step was opening the data files and understanding the structure
@@ -11,12 +11,15 @@ class Constants(Enum):
     Constants used in the package. Inherits from Enum in order to forbid
     mutable values.
     """
+    EXECUTOR_SCHEDULER = "threads"
+    HANDOFF_DIRECTORY = "/dev/shm/shape_challenge"
     LOCAL_EQUIPMENT_SENSORS_PATH = ("./data/equipment_sensors.csv")
     LOCAL_EQUIPMENT_PATH = ("./data/equipment.json")
     LOCAL_FAILURE_LOGS_PATH = ("./data/equipment_failure_sensors.log")
     LOCAL_OUTPUT_FILE_PATH = (
         "./reports/shape_challenge_report.txt"
     )
+    REPORT_SERVER_PORT = 8000
     SAMPLE_END_DATE = "2020-01-31"
     SAMPLE_EQUIPMENT_SENSORS_URL = (
         "https://raw.githubusercontent.com/gabriel-milan/"
@@ -0,0 +1,504 @@
+"""
+Delivery of the reports to webhooks, local files or the standard output.
+Reports are put in a bounded queue and delivered by a background thread, so
+the flow doesn't wait on slow or throttling webhooks. Reports queued close
+together are batched into as few messages as the sinks allow, webhooks reuse
+their connection and back off on rate limits (`429` and `Retry-After`), and
+every report is given up on after a delivery timeout.
+"""
+
+from abc import ABC, abstractmethod
+import asyncio
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+import multiprocessing
+from pathlib import Path
+import random
+import sys
+import threading
+import time
+from typing import Dict, List, Sequence, TextIO, Tuple
+from urllib.parse import urlparse
+
+import requests
+
+from shape_challenge.logging import (
+    log,
+)
+
+# Maximum length of the content of a Discord message
+DISCORD_MAX_MESSAGE_SIZE = 2000
+
+
+class Sink(ABC):
+    """
+    Destination for the reports. Subclasses implement `deliver`, and set
+    `max_message_size` if their messages have a size limit.
+    """
+
+    max_message_size: int = None
+
+    @abstractmethod
+    def deliver(self, reports: List[str], deadline: float = None) -> None:
+        """
+        Delivers a batch of reports.
+
+        Args:
+            reports (List[str]): The reports.
+            deadline (float, optional): `time.monotonic()` by which they must
+                be delivered.
+
+        Raises:
+            Exception: If the reports could not be delivered.
+        """
+
+    def close(self) -> None:
+        """
+        Releases the resources of the sink, if any.
+        """
+
+
+class StdoutSink(Sink):
+    """
+    Prints the reports to the standard output.
+    """
+
+    def __init__(self, stream: TextIO = None):
+        self.stream = stream
+
+    def __repr__(self) -> str:
+        return "StdoutSink()"
+
+    def deliver(self, reports: List[str], deadline: float = None) -> None:
+        stream = self.stream or sys.stdout
+        for report in reports:
+            print(report, file=stream, flush=True)
+
+
+class FileSink(Sink):
+    """
+    Appends the reports to a local file, separated by blank lines. The
+    directory is created if it does not exist.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def __repr__(self) -> str:
+        return f"FileSink({self.path!r})"
+
+    def deliver(self, reports: List[str], deadline: float = None) -> None:
+        Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+        with open(self.path, "a", encoding="utf-8") as file:
+            file.write("".join(f"{report}\n\n" for report in reports))
+
+
+class WebhookSink(Sink):  # pylint: disable=too-many-instance-attributes
+    """
+    Posts the reports to a webhook as `{"content": <message>}`, which is
+    what Discord expects. Reports are batched into as few messages as
+    `max_message_size` allows, and long reports are split at line breaks.
+
+    Requests share a session, so the connection is reused. Rate limits are
+    respected: on `429`, the request is retried after `Retry-After` (or
+    Discord's `retry_after`), and when `X-RateLimit-Remaining` reaches 0, the
+    next request waits for `X-RateLimit-Reset-After`. Connection errors and
+    `5xx` responses are retried with exponential backoff.
+    """
+
+    # pylint: disable=too-many-arguments,too-many-positional-arguments
+    def __init__(
+        self,
+        url: str,
+        max_message_size: int = DISCORD_MAX_MESSAGE_SIZE,
+        code_block: bool = True,
+        request_timeout: float = 10.0,
+        max_retries: int = 5,
+        max_backoff: float = 30.0,
+    ):
+        """
+        Args:
+            url (str): The webhook URL.
+            max_message_size (int, optional): Maximum length of the content
+                of a message, including the code block markers.
+            code_block (bool, optional): Whether to wrap messages in a code
+                block, so the reports keep their alignment.
+            request_timeout (float, optional): Timeout of each request, in
+                seconds.
+            max_retries (int, optional): Maximum number of retries of each
+                message.
+            max_backoff (float, optional): Maximum wait between retries, in
+                seconds.
+        """
+        self.url = url
+        self.max_message_size = max_message_size
+        self.code_block = code_block
+        self.request_timeout = request_timeout
+        self.max_retries = max_retries
+        self.max_backoff = max_backoff
+        self._session = requests.Session()
+        self._not_before = 0.0
+
+    def __repr__(self) -> str:
+        # The URL of a webhook is a secret, so only the host is shown
+        return f"WebhookSink({urlparse(self.url).netloc!r})"
+
+    def deliver(self, reports: List[str], deadline: float = None) -> None:
+        wrapper_size = 6 if self.code_block else 0
+        for message in batch_messages(reports, self.max_message_size - wrapper_size):
+            if self.code_block:
+                message = f"```{message}```"
+            self._post(message, deadline)
+
+    def close(self) -> None:
+        self._session.close()
+
+    def _post(self, message: str, deadline: float = None) -> None:
+        for attempt in range(self.max_retries + 1):
+            self._wait(self._not_before - time.monotonic(), deadline)
+            timeout = self.request_timeout
+            if deadline is not None:
+                timeout = min(timeout, max(deadline - time.monotonic(), 0.001))
+            try:
+                response = self._session.post(
+                    self.url, json={"content": message}, timeout=timeout)
+            except (requests.ConnectionError, requests.Timeout) as exc:
+                if attempt == self.max_retries:
+                    raise
+                self._wait(self._backoff(attempt), deadline, exc)
+                continue
+
+            self._track_rate_limit(response)
+            if response.status_code == 429:
+                if attempt == self.max_retries:
+                    response.raise_for_status()
+                self._wait(self._retry_after(response, attempt), deadline,
+                           "rate limited (429)")
+            elif response.status_code >= 500 and attempt < self.max_retries:
+                self._wait(self._backoff(attempt), deadline,
+                           f"server error ({response.status_code})")
+            else:
+                response.raise_for_status()
+                return
+
+    def _track_rate_limit(self, response: requests.Response) -> None:
+        if response.headers.get("X-RateLimit-Remaining") == "0":
+            reset_after = _parse_seconds(response.headers.get("X-RateLimit-Reset-After"))
+            if reset_after is not None:
+                self._not_before = time.monotonic() + reset_after
+
+    def _retry_after(self, response: requests.Response, attempt: int) -> float:
+        retry_after = _parse_seconds(response.headers.get("Retry-After"))
+        if retry_after is None:
+            try:
+                retry_after = _parse_seconds(response.json().get("retry_after"))
+            except (ValueError, AttributeError):
+                retry_after = None
+        if retry_after is None:
+            return self._backoff(attempt)
+        return min(retry_after, self.max_backoff)
+
+    def _backoff(self, attempt: int) -> float:
+        # Exponential backoff with full jitter
+        return random.uniform(0, min(self.max_backoff, 0.5 * 2 ** attempt))
+
+    @staticmethod
+    def _wait(seconds: float, deadline: float = None, reason: object = None) -> None:
+        if seconds <= 0:
+            return
+        if deadline is not None and time.monotonic() + seconds > deadline:
+            raise TimeoutError(
+                f"Delivery timed out{f' ({reason})' if reason else ''}")
+        if reason is not None:
+            log(f"Retrying delivery in {seconds:.2f}s: {reason}", level="warning")
+        time.sleep(seconds)
+
+
+def make_sink(spec: str) -> Sink:
+    """
+    Creates a sink from its description:
+
+    - `stdout`: `StdoutSink`.
+    - `http://...` or `https://...`: `WebhookSink`.
+    - `file://<path>` or any other path: `FileSink`.
+
+    Args:
+        spec (str): The description.
+
+    Returns:
+        The sink.
+    """
+    if spec == "stdout":
+        return StdoutSink()
+    if spec.startswith(("http://", "https://")):
+        return WebhookSink(spec)
+    if spec.startswith("file://"):
+        spec = spec[len("file://"):]
+    return FileSink(spec)
+
+
+def split_message(text: str, max_size: int) -> List[str]:
+    """
+    Splits a text into pieces of at most `max_size` characters, at line
+    breaks where possible.
+
+    Args:
+        text (str): The text.
+        max_size (int): Maximum size of each piece.
+
+    Returns:
+        The pieces.
+    """
+    pieces: List[str] = []
+    current = None
+    for line in text.split("\n"):
+        # Lines longer than the limit are split anywhere
+        for start in range(0, max(len(line), 1), max_size):
+            segment = line[start:start + max_size]
+            if current is not None and len(current) + 1 + len(segment) <= max_size:
+                current += "\n" + segment
+            else:
+                if current is not None:
+                    pieces.append(current)
+                current = segment
+    pieces.append(current)
+    return pieces
+
+
+def batch_messages(
+    reports: Sequence[str],
+    max_size: int = None,
+    separator: str = "\n\n",
+) -> List[str]:
+    """
+    Packs reports into as few messages as possible, in order, with at most
+    `max_size` characters each. Reports longer than that are split with
+    `split_message`.
+
+    Args:
+        reports (Sequence[str]): The reports.
+        max_size (int, optional): Maximum size of each message. If `None`,
+            there's a single message.
+        separator (str, optional): Separator between reports in a message.
+
+    Returns:
+        The messages.
+    """
+    messages: List[str] = []
+    for report in reports:
+        pieces = [report] if max_size is None else split_message(report, max_size)
+        for piece in pieces:
+            if messages and (max_size is None or
+                             len(messages[-1]) + len(separator) + len(piece) <= max_size):
+                messages[-1] += separator + piece
+            else:
+                messages.append(piece)
+    return messages
+
+
+class ReportDispatcher:  # pylint: disable=too-many-instance-attributes
+    """
+    Delivers reports to sinks in the background. `submit` puts a report in a
+    bounded queue and returns right away, unless the queue is full. An
+    asyncio event loop in a daemon thread takes everything waiting in the
+    queue as a batch and delivers it to all sinks concurrently, each sink in
+    its own thread.
+
+    Failed deliveries, including reports given up on because the queue stayed
+    full, are logged and counted, never raised, so they don't fail the
+    caller. `delivered` and `failed` count reports per sink.
+    """
+
+    def __init__(
+        self,
+        sinks: Sequence[Sink],
+        timeout: float = 30.0,
+        max_queue_size: int = 100,
+        max_batch_size: int = 50,
+    ):
+        """
+        Args:
+            sinks (Sequence[Sink]): The sinks.
+            timeout (float, optional): Seconds after being submitted by which
+                a report must be delivered, or it's given up on.
+            max_queue_size (int, optional): Maximum number of reports waiting
+                for delivery.
+            max_batch_size (int, optional): Maximum number of reports per
+                batch.
+        """
+        self.sinks = list(sinks)
+        self.timeout = timeout
+        self.max_batch_size = max_batch_size
+        self.delivered = 0
+        self.failed = 0
+        self._executor = ThreadPoolExecutor(
+            max_workers=max(len(self.sinks), 1), thread_name_prefix="report-delivery")
+        self._loop = asyncio.new_event_loop()
+        self._queue: asyncio.Queue = None
+        self._consumer: asyncio.Task = None
+        ready = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run, args=(max_queue_size, ready), daemon=True,
+            name="report-dispatcher")
+        self._thread.start()
+        ready.wait()
+
+    def submit(self, report: str) -> bool:
+        """
+        Queues a report for delivery. Waits for room in the queue if it's
+        full, up to the delivery timeout. If the queue stays full, the report
+        is given up on, and counted as failed for every sink.
+
+        Args:
+            report (str): The report.
+
+        Returns:
+            Whether the report was queued.
+        """
+        item = (time.monotonic() + self.timeout, report)
+        future = asyncio.run_coroutine_threadsafe(self._queue.put(item), self._loop)
+        try:
+            future.result(self.timeout)
+        except FutureTimeoutError:
+            future.cancel()
+            self.failed += len(self.sinks)
+            log(f"Report delivery queue stayed full for {self.timeout}s, "
+                "gave up on the report", level="error")
+            return False
+        return True
+
+    def close(self, timeout: float = None) -> bool:
+        """
+        Waits for the queued reports to be delivered, then stops the
+        dispatcher and closes the sinks.
+
+        Args:
+            timeout (float, optional): Maximum seconds to wait. Defaults to
+                the delivery timeout.
+
+        Returns:
+            Whether every queued report was handled (delivered or failed)
+            in time.
+        """
+        timeout = self.timeout if timeout is None else timeout
+        future = asyncio.run_coroutine_threadsafe(self._queue.join(), self._loop)
+        try:
+            future.result(timeout)
+            drained = True
+        except FutureTimeoutError:
+            future.cancel()
+            drained = False
+            log(f"Gave up on {self._queue.qsize()} queued reports after {timeout}s",
+                level="warning")
+        asyncio.run_coroutine_threadsafe(self._stop(), self._loop)
+        self._thread.join(timeout=1)
+        # Sinks still in use past the timeout are left to their deadlines
+        self._executor.shutdown(wait=False)
+        if drained:
+            for sink in self.sinks:
+                sink.close()
+        return drained
+
+    def _run(self, max_queue_size: int, ready: threading.Event) -> None:
+        asyncio.set_event_loop(self._loop)
+        self._queue = asyncio.Queue(max_queue_size)
+        self._consumer = self._loop.create_task(self._consume())
+        ready.set()
+        self._loop.run_forever()
+        self._loop.close()
+
+    async def _stop(self) -> None:
+        self._consumer.cancel()
+        try:
+            await self._consumer
+        except asyncio.CancelledError:
+            pass
+        self._loop.stop()
+
+    async def _consume(self) -> None:
+        while True:
+            batch = [await self._queue.get()]
+            while not self._queue.empty() and len(batch) < self.max_batch_size:
+                batch.append(self._queue.get_nowait())
+            deadline = min(item_deadline for item_deadline, _ in batch)
+            reports = [report for _, report in batch]
+            results = await asyncio.gather(
+                *(self._loop.run_in_executor(self._executor, sink.deliver, reports, deadline)
+                  for sink in self.sinks),
+                return_exceptions=True,
+            )
+            for sink, result in zip(self.sinks, results):
+                if isinstance(result, Exception):
+                    self.failed += len(reports)
+                    log(f"Failed to deliver {len(reports)} reports to {sink}: {result!r}",
+                        level="error")
+                else:
+                    self.delivered += len(reports)
+                    log(f"Delivered {len(reports)} reports to {sink}")
+            for _ in batch:
+                self._queue.task_done()
+
+
+_DISPATCHERS: Dict[Tuple[Tuple[str, ...], float], ReportDispatcher] = {}
+_DISPATCHERS_LOCK = threading.Lock()
+
+
+def get_dispatcher(
+    sink_specs: Sequence[str],
+    timeout: float = 30.0,
+) -> ReportDispatcher:
+    """
+    Returns this process' dispatcher for the given sinks and timeout,
+    creating it on first use, so that reports of the same run share
+    connections and batches.
+
+    Args:
+        sink_specs (Sequence[str]): The sinks, as described in `make_sink`.
+        timeout (float, optional): The delivery timeout, in seconds.
+
+    Returns:
+        The dispatcher.
+    """
+    key = (tuple(sink_specs), timeout)
+    with _DISPATCHERS_LOCK:
+        if key not in _DISPATCHERS:
+            _DISPATCHERS[key] = ReportDispatcher(
+                [make_sink(spec) for spec in sink_specs], timeout)
+        return _DISPATCHERS[key]
+
+
+def close_dispatchers(timeout: float = None) -> bool:
+    """
+    Closes all the dispatchers of this process, waiting at most `timeout`
+    seconds in total.
+
+    Args:
+        timeout (float, optional): Maximum seconds to wait. Defaults to each
+            dispatcher's delivery timeout.
+
+    Returns:
+        Whether every queued report was handled in time.
+    """
+    with _DISPATCHERS_LOCK:
+        dispatchers = list(_DISPATCHERS.values())
+        _DISPATCHERS.clear()
+    deadline = None if timeout is None else time.monotonic() + timeout
+    drained = True
+    for dispatcher in dispatchers:
+        remaining = None if deadline is None else max(deadline - time.monotonic(), 0)
+        drained &= dispatcher.close(remaining)
+    return drained
+
+
+def in_worker_process() -> bool:
+    """
+    Whether this is a worker process (e.g. of a process-based executor),
+    where background threads don't outlive the task that started them.
+    """
+    return multiprocessing.parent_process() is not None
+
+
+def _parse_seconds(value: object) -> float:
+    try:
+        return max(float(value), 0.0)
+    except (TypeError, ValueError):
+        return None
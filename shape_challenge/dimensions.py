@@ -0,0 +1,259 @@
+"""
+Dimension index for the equipment information: sensor -> equipment ->
+code and group. It's stored as sorted arrays, so looking up millions of
+sensors is a vectorized binary search, and it can be persisted to disk and
+reused by later runs without parsing the equipment files again.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import json
+import os
+from pathlib import Path
+from typing import Dict
+import zipfile
+
+import numpy as np
+import pandas as pd
+
+from shape_challenge.logging import (
+    log,
+)
+from shape_challenge.parsing import (
+    parse_equipment,
+    parse_equipment_sensors_relationship,
+)
+
+INDEX_VERSION = 1
+
+
+class DimensionIndex:
+    """
+    Maps sensors to their equipment, and equipment to their code and group.
+
+    Attributes:
+        sensor_ids (np.ndarray): Sorted sensor IDs.
+        sensor_equipment_ids (np.ndarray): Equipment ID of each sensor.
+        equipment_ids (np.ndarray): Sorted equipment IDs.
+        equipment_codes (np.ndarray): Code of each equipment.
+        equipment_group_names (np.ndarray): Group name of each equipment.
+        sources (Dict[str, dict]): Fingerprints of the files the index was
+            built from, used to tell whether a persisted index is stale.
+    """
+
+    # pylint: disable=too-many-arguments,too-many-positional-arguments
+    def __init__(
+        self,
+        sensor_ids: np.ndarray,
+        sensor_equipment_ids: np.ndarray,
+        equipment_ids: np.ndarray,
+        equipment_codes: np.ndarray,
+        equipment_group_names: np.ndarray,
+        sources: Dict[str, dict] = None,
+    ):
+        self.sensor_ids = sensor_ids
+        self.sensor_equipment_ids = sensor_equipment_ids
+        self.equipment_ids = equipment_ids
+        self.equipment_codes = equipment_codes
+        self.equipment_group_names = equipment_group_names
+        self.sources = sources or {}
+
+    @classmethod
+    def from_frames(
+        cls,
+        dataframe_equipment: pd.DataFrame,
+        dataframe_sensor_equipment: pd.DataFrame,
+        sources: Dict[str, dict] = None,
+    ) -> "DimensionIndex":
+        """
+        Builds the index from the parsed equipment files.
+
+        Args:
+            dataframe_equipment (pd.DataFrame): Equipment information, as
+                returned by `shape_challenge.parsing.parse_equipment`.
+            dataframe_sensor_equipment (pd.DataFrame): Equipments and sensors
+                relationships, as returned by
+                `shape_challenge.parsing.parse_equipment_sensors_relationship`.
+            sources (Dict[str, dict], optional): Fingerprints of the files.
+
+        Returns:
+            The dimension index.
+
+        Raises:
+            ValueError: If a sensor or an equipment appears more than once.
+        """
+        sensors = dataframe_sensor_equipment.sort_values("sensor_id", kind="stable")
+        equipment = dataframe_equipment.sort_values("equipment_id", kind="stable")
+        if sensors["sensor_id"].duplicated().any():
+            raise ValueError("A sensor belongs to more than one equipment")
+        if equipment["equipment_id"].duplicated().any():
+            raise ValueError("An equipment appears more than once")
+        return cls(
+            sensor_ids=sensors["sensor_id"].to_numpy(dtype=np.int64),
+            sensor_equipment_ids=sensors["equipment_id"].to_numpy(dtype=np.int64),
+            equipment_ids=equipment["equipment_id"].to_numpy(dtype=np.int64),
+            equipment_codes=equipment["code"].to_numpy(dtype=str),
+            equipment_group_names=equipment["group_name"].to_numpy(dtype=str),
+            sources=sources,
+        )
+
+    @classmethod
+    def load(cls, path: str) -> "DimensionIndex":
+        """
+        Loads a persisted index.
+
+        Args:
+            path (str): Path to the index file.
+
+        Returns:
+            The dimension index.
+
+        Raises:
+            ValueError: If the index was saved with another version.
+        """
+        with np.load(path, allow_pickle=False) as arrays:
+            version = int(arrays["version"])
+            if version != INDEX_VERSION:
+                raise ValueError(
+                    f"Dimension index version {version} is not {INDEX_VERSION}")
+            return cls(
+                sensor_ids=arrays["sensor_ids"],
+                sensor_equipment_ids=arrays["sensor_equipment_ids"],
+                equipment_ids=arrays["equipment_ids"],
+                equipment_codes=arrays["equipment_codes"],
+                equipment_group_names=arrays["equipment_group_names"],
+                sources=json.loads(str(arrays["sources"])),
+            )
+
+    def save(self, path: str) -> None:
+        """
+        Persists the index to a `.npz` file. It's written to a temporary file
+        first and then moved into place, so an interrupted save never leaves
+        a partial index behind.
+
+        Args:
+            path (str): Path to the index file. Its directory is created if
+                it does not exist.
+        """
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        temporary_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            with open(temporary_path, "wb") as file:
+                np.savez(
+                    file,
+                    version=np.array(INDEX_VERSION),
+                    sources=np.array(json.dumps(self.sources)),
+                    sensor_ids=self.sensor_ids,
+                    sensor_equipment_ids=self.sensor_equipment_ids,
+                    equipment_ids=self.equipment_ids,
+                    equipment_codes=self.equipment_codes,
+                    equipment_group_names=self.equipment_group_names,
+                )
+            os.replace(temporary_path, path)
+        except BaseException:
+            Path(temporary_path).unlink(missing_ok=True)
+            raise
+
+    def lookup(self, sensor_ids: np.ndarray) -> pd.DataFrame:
+        """
+        Looks up the equipment of each sensor.
+
+        Args:
+            sensor_ids (np.ndarray): The sensor IDs.
+
+        Returns:
+            A pandas dataframe aligned with the sensor IDs, with the same
+            equipment columns as `shape_challenge.transform.merge_data`:
+            `equipment_id`, `equipment_code` and `equipment_group_name`.
+            Unknown sensors or equipment get missing values.
+        """
+        sensor_ids = np.asarray(sensor_ids, dtype=np.int64)
+        sensor_rows = _search(self.sensor_ids, sensor_ids)
+        known_sensor = sensor_rows >= 0
+        equipment_ids = np.full(sensor_ids.shape, -1, dtype=np.int64)
+        equipment_ids[known_sensor] = self.sensor_equipment_ids[sensor_rows[known_sensor]]
+        equipment_rows = _search(self.equipment_ids, equipment_ids)
+        known_equipment = known_sensor & (equipment_rows >= 0)
+
+        # Missing values follow the dtypes of a left merge
+        codes = np.full(sensor_ids.shape, np.nan, dtype=object)
+        codes[known_equipment] = self.equipment_codes[
+            equipment_rows[known_equipment]].astype(object)
+        group_names = np.full(sensor_ids.shape, np.nan, dtype=object)
+        group_names[known_equipment] = self.equipment_group_names[
+            equipment_rows[known_equipment]].astype(object)
+        equipment_id = pd.Series(equipment_ids)
+        if not known_sensor.all():
+            equipment_id = equipment_id.where(known_sensor).astype(float)
+        return pd.DataFrame({
+            "equipment_id": equipment_id,
+            "equipment_code": codes,
+            "equipment_group_name": group_names,
+        })
+
+
+def load_or_build_dimension_index(
+    equipment_path: str,
+    sensor_equipment_path: str,
+    index_path: str = None,
+) -> DimensionIndex:
+    """
+    Loads the persisted dimension index if it's up to date with the
+    equipment files, otherwise parses them (concurrently) and builds it,
+    saving it for later runs.
+
+    Args:
+        equipment_path (str): Path to the equipment information.
+        sensor_equipment_path (str): Path to the equipments and sensors
+            relationships.
+        index_path (str, optional): Path to the persisted index. If `None`,
+            the index is built and not persisted.
+
+    Returns:
+        The dimension index.
+    """
+    sources = {
+        "equipment": _fingerprint(equipment_path),
+        "sensor_equipment": _fingerprint(sensor_equipment_path),
+    }
+    if index_path is not None and Path(index_path).is_file():
+        try:
+            index = DimensionIndex.load(index_path)
+            if index.sources == sources:
+                log(f"Loaded dimension index from {index_path}")
+                return index
+            log(f"Dimension index at {index_path} is stale, rebuilding it...")
+        except (ValueError, KeyError, OSError, EOFError, zipfile.BadZipFile) as exc:
+            log(f"Could not load dimension index at {index_path}: {exc}", level="warning")
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        equipment = executor.submit(parse_equipment, equipment_path)
+        sensor_equipment = executor.submit(
+            parse_equipment_sensors_relationship, sensor_equipment_path)
+        index = DimensionIndex.from_frames(
+            equipment.result(), sensor_equipment.result(), sources)
+    if index_path is not None:
+        index.save(index_path)
+        log(f"Saved dimension index to {index_path}")
+    return index
+
+
+def _fingerprint(path: str) -> dict:
+    # Hashes the contents, as local files can be changed in place and downloaded
+    # files are written again on every run, so paths and modification times
+    # don't tell whether the data changed
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(1 << 20), b""):
+            digest.update(chunk)
+    return {"size": Path(path).stat().st_size, "sha256": digest.hexdigest()}
+
+
+def _search(sorted_values: np.ndarray, values: np.ndarray) -> np.ndarray:
+    """
+    Returns the position of each value in a sorted array, or -1 if absent.
+    """
+    if sorted_values.size == 0:
+        return np.full(values.shape, -1)
+    positions = np.minimum(np.searchsorted(sorted_values, values), sorted_values.size - 1)
+    return np.where(sorted_values[positions] == values, positions, -1)
@@ -0,0 +1,31 @@
+"""
+Executors for running the data flow.
+"""
+
+from prefect.executors import Executor, LocalDaskExecutor, LocalExecutor
+
+
+def get_executor(
+    scheduler: str = "sequential",
+    num_workers: int = None,
+) -> Executor:
+    """
+    Gets an executor for running the data flow locally.
+
+    Args:
+        scheduler (str, optional): One of `sequential` (Prefect's default,
+            runs one task at a time), `threads` or `processes`.
+        num_workers (int, optional): Number of threads or processes. Defaults
+            to the number of CPUs. Ignored by the sequential scheduler.
+
+    Returns:
+        The executor, to be passed to `flow.run(executor=...)`.
+
+    Raises:
+        ValueError: If the scheduler is unknown.
+    """
+    if scheduler == "sequential":
+        return LocalExecutor()
+    if scheduler in ("threads", "processes"):
+        return LocalDaskExecutor(scheduler=scheduler, num_workers=num_workers)
+    raise ValueError(f"Invalid scheduler: {scheduler}")
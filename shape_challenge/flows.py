@@ -1,21 +1,35 @@
-# pylint: disable=R0801
+# pylint: disable=R0801,C0103
 """
 Implementation of the data flow using Prefect. The flow is implemented using
 parameters so we can assure this package is reusable.
+
+Independent work is split into separate tasks, so the flow can be run with
+a parallel executor (see `shape_challenge.executors`).
 """
 
-from prefect import Flow, Parameter, case
+from prefect import Flow, Parameter, case, unmapped
+from prefect.tasks.control_flow import merge
 
 from shape_challenge.tasks import (
+    combine_data,
+    deliver_report,
     download_data,
+    exceeds_memory_budget,
+    expand_failure_logs,
     filter_data,
+    flush_report_deliveries,
     generate_report,
     get_average_failures_across_equipment_groups,
+    get_failure_series,
+    get_measurement_statistics,
     get_most_failures_equipment_code,
     get_total_equipment_failures,
     is_none,
-    load_data,
-    send_report_to_discord,
+    load_dimension_index,
+    load_failure_logs_file,
+    release_handoff,
+    save_failure_series,
+    spill_data,
 )
 
 with Flow("Shape's Hard Skill Test - Data Engineer") as flow:
@@ -26,11 +40,28 @@ with Flow("Shape's Hard Skill Test - Data Engineer") as flow:
     #
     ###########################################################################
 
-    # URLs to the data files
+    # URLs to the data files. Failure logs can also be a directory, a glob
+    # pattern or a list of them
     failure_logs_url = Parameter("Failure logs URL or path")
     equipment_url = Parameter("Equipment data URL or path")
     equipment_sensors_url = Parameter(
         "Equipment-sensors relationship URL or path")
+    dimension_index_path = Parameter("Dimension index path", default=None)
+
+    # Directory for handing off large dataframes between tasks (e.g. in
+    # /dev/shm). If not given, dataframes are passed directly
+    handoff_directory = Parameter("Handoff directory", default=None)
+
+    # Memory budget for loading the failure logs. If they don't fit, they're
+    # spilled to disk in partitions
+    memory_budget_mb = Parameter("Memory budget (MB)", default=None)
+    spill_directory = Parameter("Spill directory", default=None)
+
+    # Quarantine for bad failure log lines. If no directory is given, any bad
+    # line aborts the run
+    quarantine_directory = Parameter("Quarantine directory", default=None)
+    max_quarantined_lines = Parameter("Max quarantined lines", default=None)
+    max_quarantined_ratio = Parameter("Max quarantined ratio", default=None)
 
     # Date range to filter the data
     start_date = Parameter("Start date")
@@ -40,6 +71,18 @@ with Flow("Shape's Hard Skill Test - Data Engineer") as flow:
     output_file_path = Parameter("Output report file path")
     discord_webhook_url = Parameter(
         "Discord webhook URL for report", default=None)
+    report_delivery_sinks = Parameter("Report delivery sinks", default=None)
+    report_delivery_timeout = Parameter("Report delivery timeout", default=30.0)
+    include_measurement_statistics = Parameter(
+        "Include measurement statistics", default=False)
+    measurement_statistics_output_directory = Parameter(
+        "Measurement statistics output directory", default=None)
+
+    # Failure series parameters
+    failure_series_output_directory = Parameter(
+        "Failure series output directory", default=None)
+    failure_series_frequency = Parameter(
+        "Failure series frequency", default="1h")
 
     ###########################################################################
     #
@@ -48,11 +91,51 @@ with Flow("Shape's Hard Skill Test - Data Engineer") as flow:
     ###########################################################################
 
     # Download the data
-    downloaded_files = download_data.map(
-        [failure_logs_url, equipment_url, equipment_sensors_url])
+    failure_logs_files = download_data.map(
+        expand_failure_logs(url_or_paths=failure_logs_url))
+    equipment_file = download_data(equipment_url)
+    equipment_sensors_file = download_data(equipment_sensors_url)
+
+    # Load the equipment information, reusing the persisted index if given.
+    # This runs alongside the failure logs download
+    dimension_index = load_dimension_index(
+        equipment_path=equipment_file,
+        sensor_equipment_path=equipment_sensors_file,
+        index_path=dimension_index_path,
+    )
 
-    # Merge the data
-    dataframe = load_data(filenames=downloaded_files)
+    # Parse the failure logs and merge the data, one task per file, so the
+    # executor parses them in parallel. If they don't fit in the memory
+    # budget, they're spilled to disk in partitions instead
+    spill = exceeds_memory_budget(
+        failure_logs_paths=failure_logs_files,
+        memory_budget_mb=memory_budget_mb,
+    )
+    with case(spill, False):
+        loaded_files = load_failure_logs_file.map(
+            failure_logs_path=failure_logs_files,
+            dimension_index=unmapped(dimension_index),
+            quarantine_directory=unmapped(quarantine_directory),
+            max_quarantined_lines=unmapped(max_quarantined_lines),
+            handoff_directory=unmapped(handoff_directory),
+        )
+        loaded_data = combine_data(
+            loaded_files=loaded_files,
+            max_quarantined_lines=max_quarantined_lines,
+            max_quarantined_ratio=max_quarantined_ratio,
+            handoff_directory=handoff_directory,
+        )
+    with case(spill, True):
+        spilled_data = spill_data(
+            failure_logs_paths=failure_logs_files,
+            dimension_index=dimension_index,
+            memory_budget_mb=memory_budget_mb,
+            spill_directory=spill_directory,
+            quarantine_directory=quarantine_directory,
+            max_quarantined_lines=max_quarantined_lines,
+            max_quarantined_ratio=max_quarantined_ratio,
+        )
+    merged_data = merge(loaded_data, spilled_data)
 
     ###########################################################################
     #
@@ -62,10 +145,11 @@ with Flow("Shape's Hard Skill Test - Data Engineer") as flow:
 
     # Filter the data
     dataframe = filter_data(
-        dataframe=dataframe,
+        dataframe=merged_data,
         filter_column="timestamp",
         range_start=start_date,
         range_end=end_date,
+        handoff_directory=handoff_directory,
     )
 
     ###########################################################################
@@ -84,6 +168,16 @@ with Flow("Shape's Hard Skill Test - Data Engineer") as flow:
     average_failures = get_average_failures_across_equipment_groups(
         dataframe=dataframe)
 
+    # Temperature and vibration statistics, only if requested. Statistics by
+    # sensor and equipment are also computed and saved if a directory is given
+    with case(include_measurement_statistics, True):
+        measurement_statistics = get_measurement_statistics(
+            dataframe=dataframe,
+            output_directory=measurement_statistics_output_directory,
+        )
+        group_statistics = measurement_statistics["equipment_group_name"]
+    group_measurement_statistics = merge(group_statistics)
+
     ###########################################################################
     #
     # Tasks section #4 - Generate report and save it.
@@ -98,11 +192,64 @@ with Flow("Shape's Hard Skill Test - Data Engineer") as flow:
         average_failures_across_equipment_groups=average_failures,
         range_min=start_date,
         range_max=end_date,
+        measurement_statistics=group_measurement_statistics,
+    )
+
+    # Deliver the report to Discord and the other sinks, if any, in the
+    # background. Delivery is awaited at the very end of the flow
+    delivery = deliver_report(
+        report_text=report_text,
+        sinks=report_delivery_sinks,
+        discord_webhook_url=discord_webhook_url,
+        timeout=report_delivery_timeout,
     )
 
-    # Send the report to Discord if a webhook URL is provided
-    with case(is_none(value=discord_webhook_url), False):
-        send_report_to_discord(
-            report_text=report_text,
-            discord_webhook_url=discord_webhook_url,
+    # Save failure series per equipment and group if a directory is provided
+    with case(is_none(value=failure_series_output_directory), False):
+        failure_series = get_failure_series(
+            dataframe=dataframe,
+            frequency=failure_series_frequency,
+            range_start=start_date,
+            range_end=end_date,
+        )
+        saved_failure_series = save_failure_series(
+            failure_series=failure_series,
+            output_directory=failure_series_output_directory,
+            frequency=failure_series_frequency,
         )
+
+    ###########################################################################
+    #
+    # Tasks section #5 - Clean up
+    #
+    ###########################################################################
+
+    # Release the dataframes handed off between tasks, if any
+    merged_data_release = release_handoff(
+        frame=merged_data, upstream_tasks=[dataframe])
+    dataframe_release = release_handoff(
+        frame=dataframe,
+        upstream_tasks=[
+            total_failures,
+            equipment_code,
+            average_failures,
+            measurement_statistics,
+            failure_series,
+        ],
+    )
+
+    # Wait for the report deliveries, once everything else is done
+    flush_report_deliveries(
+        timeout=report_delivery_timeout,
+        upstream_tasks=[
+            delivery,
+            saved_failure_series,
+            merged_data_release,
+            dataframe_release,
+        ],
+    )
+
+# The clean up tasks run even when upstream tasks fail, so the flow's state is
+# given by the report, measurement statistics and failure series tasks instead
+flow.set_reference_tasks(
+    [report_text, delivery, measurement_statistics, saved_failure_series])
@@ -0,0 +1,252 @@
+"""
+Handoff of large dataframes between tasks. Instead of returning a dataframe,
+which every parallel or process-based executor pickles and copies on each
+edge of the flow, a task can store it as one `.npy` file per column and return
+a lightweight `FrameHandle`. Downstream tasks memory-map the columns they
+need, so nothing is copied until it's actually read. With a directory in
+`/dev/shm`, the files live in shared memory.
+"""
+
+import json
+from pathlib import Path
+import shutil
+from typing import Callable, Iterator, List, Sequence, Union
+import uuid
+
+import numpy as np
+import pandas as pd
+
+from shape_challenge.logging import (
+    log,
+)
+
+
+class FrameHandle:
+    """
+    Reference to a dataframe stored by `put_frame`. It only holds the
+    directory and the schema, so it's cheap to pickle.
+
+    Attributes:
+        directory (str): Directory with the column files.
+        columns (List[str]): Column names, in order.
+        kinds (List[str]): How each column is stored: `values` (numeric or
+            boolean values), `datetime` (nanoseconds as int64) or `category`
+            (integer codes plus a JSON file with the categories).
+        n_rows (int): Number of rows.
+    """
+
+    def __init__(self, directory: str, columns: List[str], kinds: List[str], n_rows: int):
+        self.directory = directory
+        self.columns = columns
+        self.kinds = kinds
+        self.n_rows = n_rows
+
+    def __repr__(self) -> str:
+        return f"FrameHandle({self.directory!r}, n_rows={self.n_rows})"
+
+    @property
+    def nbytes(self) -> int:
+        """
+        Size of the column files, in bytes.
+        """
+        return sum(path.stat().st_size for path in Path(self.directory).iterdir())
+
+
+class PartitionedFrame:
+    """
+    A dataframe too large for memory, stored on disk as partitions. Each
+    partition is a list of `FrameHandle` chunks and fits in memory on its
+    own. Rows are partitioned by equipment, so every equipment is entirely
+    within a single partition.
+
+    Attributes:
+        directory (str): Directory where the chunks are stored.
+        partitions (List[List[FrameHandle]]): The chunks of each partition.
+    """
+
+    def __init__(self, directory: str, partitions: List[List[FrameHandle]]):
+        self.directory = directory
+        self.partitions = partitions
+
+    def __repr__(self) -> str:
+        return (f"PartitionedFrame({self.directory!r}, "
+                f"partitions={len(self.partitions)}, n_rows={self.n_rows})")
+
+    @property
+    def n_rows(self) -> int:
+        """
+        Number of rows across all partitions.
+        """
+        return sum(chunk.n_rows for partition in self.partitions for chunk in partition)
+
+    @property
+    def nbytes(self) -> int:
+        """
+        Size of the files of all partitions, in bytes.
+        """
+        return sum(chunk.nbytes for partition in self.partitions for chunk in partition)
+
+    def map(self, function: Callable[[pd.DataFrame], pd.DataFrame]) -> "PartitionedFrame":
+        """
+        Applies a row-wise function (e.g. a filter) to every partition,
+        storing the results as a new partitioned frame in the same directory,
+        one chunk per partition. The partitioning is kept.
+
+        Args:
+            function (Callable[[pd.DataFrame], pd.DataFrame]): The function.
+
+        Returns:
+            The new partitioned frame.
+        """
+        partitions = []
+        try:
+            for partition in self.partitions:
+                chunks = []
+                if partition:
+                    dataframe = function(pd.concat(
+                        [resolve_frame(chunk) for chunk in partition], ignore_index=True))
+                    if dataframe.shape[0] > 0:
+                        chunks.append(put_frame(dataframe, self.directory))
+                partitions.append(chunks)
+        except BaseException:
+            release_frame(PartitionedFrame(self.directory, partitions))
+            raise
+        return PartitionedFrame(self.directory, partitions)
+
+
+def put_frame(
+    dataframe: pd.DataFrame,
+    directory: str,
+) -> FrameHandle:
+    """
+    Stores a dataframe as memory-mappable column files in a new
+    subdirectory of `directory`. The index is not kept.
+
+    Args:
+        dataframe (pd.DataFrame): The dataframe to store.
+        directory (str): Base directory, e.g. in `/dev/shm`.
+
+    Returns:
+        A handle to the stored dataframe.
+    """
+    path = Path(directory) / uuid.uuid4().hex
+    path.mkdir(parents=True)
+    kinds = []
+    for position, column in enumerate(dataframe.columns):
+        series = dataframe[column]
+        if pd.api.types.is_datetime64_dtype(series):
+            kinds.append("datetime")
+            values = series.to_numpy(dtype="datetime64[ns]").view(np.int64)
+        elif pd.api.types.is_numeric_dtype(series) or pd.api.types.is_bool_dtype(series):
+            kinds.append("values")
+            values = series.to_numpy()
+        else:
+            kinds.append("category")
+            if isinstance(series.dtype, pd.CategoricalDtype):
+                values, categories = series.cat.codes.to_numpy(), series.cat.categories
+            else:
+                # Sorted, so grouping by the categorical keeps the same order
+                values, categories = pd.factorize(series, sort=True)
+            values = values.astype(_code_dtype(len(categories)))
+            with open(path / f"{position}.json", "w", encoding="utf-8") as file:
+                json.dump(list(categories), file)
+        np.save(path / f"{position}.npy", values, allow_pickle=False)
+    return FrameHandle(str(path), list(dataframe.columns), kinds, dataframe.shape[0])
+
+
+def iter_frames(
+    frame: Union[pd.DataFrame, FrameHandle, PartitionedFrame],
+    columns: Sequence[str] = None,
+) -> Iterator[pd.DataFrame]:
+    """
+    Iterates over the partitions of a partitioned frame, one dataframe per
+    partition. Dataframes and handles are a single partition.
+
+    Args:
+        frame (Union[pd.DataFrame, FrameHandle, PartitionedFrame]): A
+            dataframe, a handle or a partitioned frame.
+        columns (Sequence[str], optional): Columns to load. Defaults to all.
+
+    Yields:
+        The dataframe of each partition.
+    """
+    if not isinstance(frame, PartitionedFrame):
+        yield resolve_frame(frame, columns)
+        return
+    for partition in frame.partitions:
+        if partition:
+            yield pd.concat([resolve_frame(chunk, columns) for chunk in partition],
+                            ignore_index=True)
+
+
+def resolve_frame(
+    frame: Union[pd.DataFrame, FrameHandle, PartitionedFrame],
+    columns: Sequence[str] = None,
+) -> pd.DataFrame:
+    """
+    Returns the dataframe for a handle, with its columns memory-mapped
+    read-only. Dataframes are returned as they are, so tasks can take either.
+    Partitioned frames are loaded whole, so prefer `iter_frames` for them.
+
+    Args:
+        frame (Union[pd.DataFrame, FrameHandle, PartitionedFrame]): A
+            dataframe, a handle or a partitioned frame.
+        columns (Sequence[str], optional): Columns to map. Defaults to all.
+
+    Returns:
+        The dataframe.
+    """
+    if isinstance(frame, PartitionedFrame):
+        return pd.concat(
+            [resolve_frame(chunk, columns) for partition in frame.partitions
+             for chunk in partition],
+            ignore_index=True,
+        )
+    if not isinstance(frame, FrameHandle):
+        return frame
+    data = {}
+    for position, (column, kind) in enumerate(zip(frame.columns, frame.kinds)):
+        if columns is not None and column not in columns:
+            continue
+        values = np.load(Path(frame.directory) / f"{position}.npy", mmap_mode="r")
+        if kind == "datetime":
+            values = values.view("datetime64[ns]")
+        elif kind == "category":
+            with open(Path(frame.directory) / f"{position}.json", encoding="utf-8") as file:
+                values = pd.Categorical.from_codes(values, categories=json.load(file))
+        data[column] = values
+    return pd.DataFrame(data, copy=False)
+
+
+def _code_dtype(n_categories: int) -> np.dtype:
+    # Same as pandas' own choice for categorical codes, so they aren't copied
+    for dtype in (np.int8, np.int16, np.int32):
+        if n_categories < np.iinfo(dtype).max:
+            return np.dtype(dtype)
+    return np.dtype(np.int64)
+
+
+def release_frame(
+    frame: Union[pd.DataFrame, FrameHandle, PartitionedFrame],
+) -> None:
+    """
+    Deletes the files of a handle or a partitioned frame. Does nothing for
+    dataframes.
+
+    Args:
+        frame (Union[pd.DataFrame, FrameHandle, PartitionedFrame]): A
+            dataframe, a handle or a partitioned frame.
+    """
+    if isinstance(frame, PartitionedFrame):
+        for partition in frame.partitions:
+            for chunk in partition:
+                shutil.rmtree(chunk.directory, ignore_errors=True)
+        # Other partitioned frames may still have chunks in the directory
+        try:
+            Path(frame.directory).rmdir()
+        except OSError:
+            pass
+        log(f"Released {frame}")
+    elif isinstance(frame, FrameHandle):
+        shutil.rmtree(frame.directory, ignore_errors=True)
+        log(f"Released {frame}")
@@ -10,7 +10,9 @@ import prefect
 
 def log(msg: Any, level: str = "info") -> None:
     """
-    Logs a message to prefect's logger.
+    Logs a message to prefect's logger. Outside of a flow run (e.g. when
+    tasks are called from the report server), falls back to this package's
+    standard logger.
     """
     levels = {
         "debug": logging.DEBUG,
@@ -21,4 +23,5 @@ def log(msg: Any, level: str = "info") -> None:
     }
     if level not in levels:
         raise ValueError(f"Invalid log level: {level}")
-    prefect.context.logger.log(levels[level], msg)  # pylint: disable=E1101
+    logger = prefect.context.get("logger") or logging.getLogger("shape_challenge")
+    logger.log(levels[level], msg)
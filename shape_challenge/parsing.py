@@ -2,20 +2,173 @@
 Gather data and clean it a little bit, just enough to use it down the road.
 """
 
+import glob
+import json
+from pathlib import Path
 import re
-from typing import List
+from typing import Any, Iterable, Iterator, List, Tuple, Union
 
 import pandas as pd
 
+from shape_challenge.quarantine import Quarantine
+
+# JSON files larger than this, in bytes, are streamed instead of loaded at once
+JSON_STREAM_THRESHOLD = 64 * 2**20
+
+FAILURE_LOG_REGEX = re.compile(
+    r"\[(\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2})\]\t(.+?(?=\t))\tsensor\[(.+?)\]:\t\(temperature\t(.+?(?=,)), vibration\t(.+?(?=\)))"  # pylint: disable=line-too-long
+)
+FAILURE_LOG_COLUMNS = ["timestamp", "message_level",
+                       "sensor_id", "temperature", "vibration"]
+
+
+def expand_paths(
+    url_or_paths: Union[str, List[str]],
+) -> List[str]:
+    """
+    Expands a URL or path, or a list of them, into a list of files. Each item
+    can be a URL, a file, a directory (all of its non-hidden files are used)
+    or a glob pattern (e.g. `logs/equipment_failure_sensors.log.*`).
+
+    Args:
+        url_or_paths (Union[str, List[str]]): The URLs or paths to expand.
+
+    Returns:
+        The URLs and file paths, in order. Files from a directory or a glob
+        pattern are sorted by name.
+
+    Raises:
+        ValueError: If an item is neither a URL, a file, a directory nor a
+            glob pattern that matches any file.
+    """
+    if isinstance(url_or_paths, str):
+        url_or_paths = [url_or_paths]
+    paths: List[str] = []
+    for url_or_path in url_or_paths:
+        path = Path(url_or_path)
+        if "://" in url_or_path or path.is_file():
+            paths.append(url_or_path)
+        elif path.is_dir():
+            paths += sorted(str(child) for child in path.iterdir()
+                            if child.is_file() and not child.name.startswith("."))
+        else:
+            matches = sorted(match for match in glob.glob(url_or_path)
+                             if Path(match).is_file())
+            if not matches:
+                raise ValueError(f"No files found for {url_or_path}")
+            paths += matches
+    return paths
+
+
+def iter_json_array(
+    fname: str,
+    chunk_size: int = 1 << 20,
+) -> Iterator[Any]:
+    """
+    Iterates over the items of a JSON file that contains a single array,
+    reading it in chunks so that only one item at a time is decoded and the
+    file is never loaded as a whole.
+
+    Args:
+        fname (str): The filename of the JSON file.
+        chunk_size (int, optional): Number of characters read at a time.
+
+    Yields:
+        The decoded items of the array.
+
+    Raises:
+        ValueError: If the file is not a JSON array.
+    """
+    decoder = json.JSONDecoder()
+    whitespace = re.compile(r"\s*")
+    with open(fname, "r", encoding="utf-8") as file:
+        buffer, position, eof = "", 0, False
+        expected = "["
+        while True:
+            position = whitespace.match(buffer, position).end()
+            if position < len(buffer):
+                char = buffer[position]
+                if expected == "[":
+                    if char != "[":
+                        raise ValueError(f"{fname} does not contain a JSON array")
+                    position, expected = position + 1, "item"
+                    continue
+                if char == "]":
+                    return
+                if expected == ",":
+                    if char != ",":
+                        raise ValueError(f"Invalid JSON array in {fname}")
+                    position, expected = position + 1, "item"
+                    continue
+                try:
+                    item, end = decoder.raw_decode(buffer, position)
+                except json.JSONDecodeError:
+                    end = None
+                # A value that ends with the buffer might continue in the next chunk
+                if end is not None and (end < len(buffer) or eof):
+                    yield item
+                    position, expected = end, ","
+                    continue
+
+            # Needs more data
+            if eof:
+                raise ValueError(f"Invalid JSON array in {fname}")
+            chunk = file.read(chunk_size)
+            eof = not chunk
+            buffer, position = buffer[position:] + chunk, 0
+
+
+def parse_equipment(
+    fname: str,
+) -> pd.DataFrame:
+    """
+    Parses the JSON file that contains the equipment information, an array
+    of objects with `equipment_id`, `code` and `group_name`. Files larger
+    than `JSON_STREAM_THRESHOLD` bytes are streamed (see `iter_json_array`),
+    so large catalogs are never loaded into memory as a whole. Smaller ones
+    are loaded at once, which is faster.
+
+    Args:
+        fname (str): The filename of the JSON file.
+
+    Returns:
+        A pandas dataframe with the equipment information. Columns are:
+
+        - equipment_id (int): The equipment ID.
+        - code (str): Another identifier code for the equipment.
+        - group_name (str): Name of the group the equipment belongs to.
+
+    Raises:
+        ValueError: If the file is not a JSON array.
+    """
+    if Path(fname).stat().st_size > JSON_STREAM_THRESHOLD:
+        items: Iterable[dict] = iter_json_array(fname)
+    else:
+        with open(fname, "r", encoding="utf-8") as file:
+            items = json.load(file)
+        if not isinstance(items, list):
+            raise ValueError(f"{fname} does not contain a JSON array")
+    equipment_ids: List[int] = []
+    codes: List[str] = []
+    group_names: List[str] = []
+    for equipment in items:
+        equipment_ids.append(equipment["equipment_id"])
+        codes.append(equipment["code"])
+        group_names.append(equipment["group_name"])
+    return pd.DataFrame({
+        "equipment_id": pd.Series(equipment_ids, dtype="int64"),
+        "code": pd.Series(codes, dtype="object"),
+        "group_name": pd.Series(group_names, dtype="object"),
+    })
+
 
 def parse_equipment_sensors_relationship(
     fname: str,
 ) -> pd.DataFrame:
     """
     Parses the CSV file that contains equipments and sensors relationships.
-    As it contains a single column with both values separated by a semicolon,
-    it's possible to split it into two columns and then delete the original
-    one.
+    Values are separated by a semicolon, so they're parsed straight into two
+    integer columns.
 
     Args:
         fname (str): The filename of the CSV file.
@@ -27,26 +180,17 @@ def parse_equipment_sensors_relationship(
         - equipment_id (int): The equipment ID.
         - sensor_id (int): The sensor ID.
     """
-    # Load data
-    dataframe = pd.read_csv(fname)
-
-    # Split columns
-    dataframe["equipment_id"] = \
-        dataframe["equipment_id;sensor_id"].str.split(";", expand=True)[0]
-    dataframe["sensor_id"] = \
-        dataframe["equipment_id;sensor_id"].str.split(";", expand=True)[1]
-
-    # Delete original column
-    dataframe = dataframe.drop("equipment_id;sensor_id", axis=1)
-
-    # Convert column types
-    dataframe["equipment_id"] = dataframe["equipment_id"].astype(int)
-    dataframe["sensor_id"] = dataframe["sensor_id"].astype(int)
-    return dataframe
+    return pd.read_csv(
+        fname,
+        sep=";",
+        usecols=["equipment_id", "sensor_id"],
+        dtype={"equipment_id": "int64", "sensor_id": "int64"},
+    )[["equipment_id", "sensor_id"]]
 
 
 def parse_failure_logs(
     fname: str,
+    quarantine: Quarantine = None,
 ) -> pd.DataFrame:
     """
     Parses the failure logs from a given file. Format of each line is:
@@ -55,8 +199,14 @@ def parse_failure_logs(
         vibration\t<vibration>)
     ```
 
+    By default, a line that doesn't match this format raises an error. If a
+    quarantine is given, lines that don't match, can't be decoded, have
+    invalid values or have a message level other than `ERROR` are sent to it
+    instead, and parsing goes on.
+
     Args:
         fname (str): The filename of the failure logs.
+        quarantine (Quarantine, optional): Where to send rejected lines.
 
     Returns:
         A pandas dataframe with the failure logs. Columns are:
@@ -67,26 +217,76 @@ def parse_failure_logs(
         - temperature (float): The temperature measured by the sensor.
         - vibration (float): The vibration measured by the sensor.
     """
+    if quarantine is not None:
+        chunks = list(iter_failure_logs(fname, quarantine=quarantine))
+        return chunks[0] if chunks else parse_failure_log_lines([])
+
     # Open file for reading
     with open(fname, 'r', encoding='utf-8') as file:
         lines: List[str] = file.readlines()
 
+    return parse_failure_log_lines(lines)
+
+
+def iter_failure_logs(
+    fname: str,
+    chunk_size: int = None,
+    quarantine: Quarantine = None,
+) -> Iterator[pd.DataFrame]:
+    """
+    Parses the failure logs from a given file in chunks, so that only about
+    `chunk_size` bytes of the file are held in memory at a time. See
+    `parse_failure_logs` for the format and the quarantine.
+
+    Args:
+        fname (str): The filename of the failure logs.
+        chunk_size (int, optional): Approximate number of bytes per chunk.
+            If `None`, the whole file is a single chunk.
+        quarantine (Quarantine, optional): Where to send rejected lines.
+
+    Yields:
+        A pandas dataframe for each chunk, with the same columns as
+        `parse_failure_logs`.
+    """
+    hint = chunk_size or -1
+    if quarantine is None:
+        with open(fname, "r", encoding="utf-8") as file:
+            for lines in iter(lambda: file.readlines(hint), []):
+                yield parse_failure_log_lines(lines)
+        return
+
+    offset = 0
+    with open(fname, "rb") as file:
+        for raw_lines in iter(lambda: file.readlines(hint), []):
+            dataframe, offset = parse_failure_log_bytes(raw_lines, offset, quarantine)
+            yield dataframe
+    quarantine.close()
+
+
+def parse_failure_log_lines(
+    lines: Iterable[str],
+) -> pd.DataFrame:
+    """
+    Parses failure log lines, as read from a failure logs file. See
+    `parse_failure_logs` for the format of each line.
+
+    Args:
+        lines (Iterable[str]): The lines to parse.
+
+    Returns:
+        A pandas dataframe with the failure logs, with the same columns as
+        `parse_failure_logs`.
+    """
     # Parse each line
     data: List[List[str]] = []
-    regex = \
-        r"\[(\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2})\]\t(.+?(?=\t))\tsensor\[(.+?)\]:\t\(temperature\t(.+?(?=,)), vibration\t(.+?(?=\)))"  # pylint: disable=line-too-long
     for line in lines:
-        values = re.findall(regex, line)
+        values = FAILURE_LOG_REGEX.findall(line)
         if (len(values) != 1) or (len(values[0]) != 5):
             raise ValueError(f"Error while parsing line: {line}")
         data += [values[0]]
 
     # Convert to dataframe
-    dataframe = pd.DataFrame(
-        data,
-        columns=["timestamp", "message_level",
-                 "sensor_id", "temperature", "vibration"]
-    )
+    dataframe = pd.DataFrame(data, columns=FAILURE_LOG_COLUMNS)
 
     # Convert column types
     dataframe["timestamp"] = pd.to_datetime(dataframe["timestamp"])
@@ -95,3 +295,67 @@ def parse_failure_logs(
     dataframe["vibration"] = dataframe["vibration"].astype(float)
 
     return dataframe
+
+
+def parse_failure_log_bytes(
+    raw_lines: List[bytes],
+    offset: int,
+    quarantine: Quarantine,
+) -> Tuple[pd.DataFrame, int]:
+    """
+    Parses failure log lines as raw bytes, sending the lines that can't be
+    used to a quarantine instead of raising (see `parse_failure_logs`).
+
+    Args:
+        raw_lines (List[bytes]): The lines, with their line breaks.
+        offset (int): Byte offset of the first line in the file.
+        quarantine (Quarantine): Where to send rejected lines.
+
+    Returns:
+        A tuple with a pandas dataframe with the same columns as
+        `parse_failure_logs` and the byte offset past the last line.
+    """
+    # Parse each line, keeping track of byte offsets for the quarantine
+    data: List[List[str]] = []
+    offsets: List[int] = []
+    for raw_line in raw_lines:
+        line_offset, offset = offset, offset + len(raw_line)
+        try:
+            line = raw_line.decode("utf-8")
+        except UnicodeDecodeError:
+            quarantine.add(line_offset, "undecodable",
+                           raw_line.decode("utf-8", errors="replace"))
+            continue
+        values = FAILURE_LOG_REGEX.findall(line)
+        if (len(values) != 1) or (len(values[0]) != 5):
+            quarantine.add(line_offset, "malformed", line)
+        elif values[0][1] != "ERROR":
+            quarantine.add(line_offset, f"level:{values[0][1]}", line)
+        else:
+            data += [values[0]]
+            offsets += [line_offset]
+
+    # Convert to dataframe
+    dataframe = pd.DataFrame(data, columns=FAILURE_LOG_COLUMNS)
+
+    # Convert column types, quarantining rows with invalid values
+    timestamp = pd.to_datetime(dataframe["timestamp"], errors="coerce")
+    sensor_id = pd.to_numeric(dataframe["sensor_id"], errors="coerce")
+    temperature = pd.to_numeric(dataframe["temperature"], errors="coerce")
+    vibration = pd.to_numeric(dataframe["vibration"], errors="coerce")
+    invalid = (timestamp.isna() | sensor_id.isna() | (sensor_id % 1 != 0) |
+               temperature.isna() | vibration.isna()).to_numpy()
+    for index in invalid.nonzero()[0]:
+        quarantine.add(offsets[index], "invalid_value",
+                       "\t".join(data[index]))
+    dataframe["timestamp"] = timestamp
+    dataframe["sensor_id"] = sensor_id
+    dataframe["temperature"] = temperature
+    dataframe["vibration"] = vibration
+    dataframe = dataframe[~invalid].reset_index(drop=True)
+    dataframe["sensor_id"] = dataframe["sensor_id"].astype(int)
+    dataframe["temperature"] = dataframe["temperature"].astype(float)
+    dataframe["vibration"] = dataframe["vibration"].astype(float)
+
+    quarantine.accepted += dataframe.shape[0]
+    return dataframe, offset
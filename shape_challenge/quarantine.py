@@ -0,0 +1,130 @@
+"""
+Quarantine for failure log lines that can't be used, so that a few bad lines
+don't abort the whole run.
+"""
+
+from collections import Counter
+from pathlib import Path
+from typing import Dict, TextIO
+
+
+class Quarantine:
+    """
+    Collects rejected lines into a quarantine file and counts them per
+    category, enforcing an error budget. Each line of the quarantine file is
+    `<byte_offset>\\t<category>\\t<line>`, where the byte offset is the
+    position of the rejected line in the original file.
+
+    Categories are:
+
+    - `malformed`: The line doesn't match the failure logs format.
+    - `undecodable`: The line is not valid UTF-8.
+    - `invalid_value`: The timestamp, sensor ID or measurements can't be
+        converted to their types. The parsed fields are written instead of
+        the original line, which can be found by its byte offset.
+    - `level:<level>`: The message level is not `ERROR`.
+
+    Instances hold no open file between calls to `close` and `add`, so they
+    can be sent to and from worker processes and merged with `merge`. Any
+    quarantine file left by an earlier run is removed when the instance is
+    created, so the file only exists if lines were rejected.
+    """
+
+    def __init__(
+        self,
+        path: str = None,
+        max_errors: int = None,
+        max_error_ratio: float = None,
+    ):
+        """
+        Args:
+            path (str, optional): The quarantine file. If `None`, rejected
+                lines are only counted.
+            max_errors (int, optional): Maximum number of rejected lines.
+            max_error_ratio (float, optional): Maximum ratio of rejected lines
+                to all lines seen.
+        """
+        self.path = path
+        self.max_errors = max_errors
+        self.max_error_ratio = max_error_ratio
+        self.counts: Dict[str, int] = Counter()
+        self.accepted = 0
+        self._file: TextIO = None
+        self._written = False
+        if path is not None:
+            Path(path).unlink(missing_ok=True)
+
+    @property
+    def errors(self) -> int:
+        """
+        The number of rejected lines.
+        """
+        return sum(self.counts.values())
+
+    def add(self, offset: int, category: str, line: str) -> None:
+        """
+        Quarantines a line.
+
+        Args:
+            offset (int): Byte offset of the line in the original file.
+            category (str): Why the line was rejected.
+            line (str): The line.
+
+        Raises:
+            ValueError: If this exceeds `max_errors`.
+        """
+        if self.path is not None:
+            if self._file is None:
+                # pylint: disable=consider-using-with
+                self._file = open(self.path, "a" if self._written else "w",
+                                  encoding="utf-8")
+                self._written = True
+            line = line.rstrip("\r\n")
+            self._file.write(f"{offset}\t{category}\t{line}\n")
+        self.counts[category] += 1
+        if self.max_errors is not None and self.errors > self.max_errors:
+            self.close()
+            self.check_budget()
+
+    def check_budget(self) -> None:
+        """
+        Checks that the rejected lines are within the error budget.
+
+        Raises:
+            ValueError: If the error budget is exceeded.
+        """
+        total = self.errors + self.accepted
+        exceeded = self.max_errors is not None and self.errors > self.max_errors
+        exceeded |= (self.max_error_ratio is not None and total > 0 and
+                     self.errors / total > self.max_error_ratio)
+        if exceeded:
+            raise ValueError(
+                f"Error budget exceeded: {self.errors} lines quarantined out "
+                f"of {total} ({self.summary()})")
+
+    def close(self) -> None:
+        """
+        Closes the quarantine file, if open.
+        """
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def merge(self, other: "Quarantine") -> None:
+        """
+        Adds the counts of another quarantine to this one.
+
+        Args:
+            other (Quarantine): The quarantine to merge.
+        """
+        self.counts.update(other.counts)
+        self.accepted += other.accepted
+
+    def summary(self) -> str:
+        """
+        Returns the counts per category as text, e.g. `malformed: 2, level:INFO: 5`.
+        """
+        if not self.counts:
+            return "no lines quarantined"
+        return ", ".join(
+            f"{category}: {count}" for category, count in sorted(self.counts.items()))
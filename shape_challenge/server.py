@@ -0,0 +1,373 @@
+"""
+Long-running report server. The data is loaded and merged once, kept in
+memory in a compact form and refreshed incrementally as new lines are appended
+to the failure logs. Reports for arbitrary date ranges are served over a local
+HTTP endpoint and computed by the same tasks as the data flow, with an LRU
+cache of the results.
+"""
+
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import threading
+from typing import Any, Callable, Dict, Hashable, Tuple
+from urllib.parse import parse_qs, urlparse
+
+import pandas as pd
+
+from shape_challenge.dimensions import (
+    load_or_build_dimension_index,
+)
+from shape_challenge.logging import (
+    log,
+)
+from shape_challenge.parsing import (
+    parse_failure_log_bytes,
+)
+from shape_challenge.quarantine import (
+    Quarantine,
+)
+from shape_challenge.tasks import (
+    generate_report,
+    get_average_failures_across_equipment_groups,
+    get_most_failures_equipment_code,
+    get_total_equipment_failures,
+)
+from shape_challenge.transform import (
+    merge_with_dimension_index,
+)
+
+# Approximate number of bytes of failure logs parsed at a time by `refresh`
+REFRESH_CHUNK_SIZE = 4 * 2**20
+
+
+class ReportDataset:  # pylint: disable=too-many-instance-attributes
+    """
+    Merged failure data kept in memory, sorted by timestamp so that a date
+    range is a slice instead of a scan. Equipment codes and group names are
+    stored as categoricals. New lines appended to the failure logs are picked
+    up by `refresh`, which only reads the bytes past the last complete line.
+    Lines that can't be used are skipped and sent to a quarantine (see
+    `shape_challenge.quarantine`), so they never block later refreshes.
+    """
+
+    def __init__(
+        self,
+        failure_logs_path: str,
+        equipment_path: str,
+        equipment_sensors_path: str,
+        dimension_index_path: str = None,
+        quarantine_path: str = None,
+    ):
+        self.failure_logs_path = failure_logs_path
+        self.quarantine = Quarantine(quarantine_path)
+        self.version = 0
+        self._lock = threading.Lock()
+        self._offset = 0
+        self._dimension_index = load_or_build_dimension_index(
+            equipment_path, equipment_sensors_path, dimension_index_path)
+        self._dtypes = {
+            "equipment_code": pd.CategoricalDtype(
+                sorted(set(self._dimension_index.equipment_codes.tolist()))),
+            "equipment_group_name": pd.CategoricalDtype(
+                sorted(set(self._dimension_index.equipment_group_names.tolist()))),
+        }
+        self._dataframe: pd.DataFrame = None
+        self.refresh()
+
+    def __len__(self) -> int:
+        return 0 if self._dataframe is None else self._dataframe.shape[0]
+
+    def refresh(self) -> int:
+        """
+        Parses the complete lines appended to the failure logs since the last
+        refresh and adds them to the dataset. Lines are read, parsed and
+        compacted in chunks of about `REFRESH_CHUNK_SIZE` bytes, so the raw
+        lines are never held in memory all at once.
+
+        Returns:
+            The number of new failures.
+        """
+        errors = self.quarantine.errors
+        offset = self._offset
+        new_frames = []
+        with open(self.failure_logs_path, "rb") as file:
+            file.seek(offset)
+            for raw_lines in iter(lambda: file.readlines(REFRESH_CHUNK_SIZE), []):
+                # A line without a line break is still being written
+                if not raw_lines[-1].endswith(b"\n"):
+                    raw_lines.pop()
+                if raw_lines:
+                    failure_logs, offset = parse_failure_log_bytes(
+                        raw_lines, offset, self.quarantine)
+                    new_frames.append(self._compact(merge_with_dimension_index(
+                        failure_logs,
+                        self._dimension_index,
+                    )))
+        self.quarantine.close()
+        if self.quarantine.errors > errors:
+            log(f"Quarantined {self.quarantine.errors - errors} lines "
+                f"({self.quarantine.summary()} in total)", level="warning")
+        if offset == self._offset:
+            return 0
+        n_new = sum(frame.shape[0] for frame in new_frames)
+        frames = new_frames if self._dataframe is None else [self._dataframe, *new_frames]
+        dataframe = frames[0] if len(frames) == 1 else pd.concat(frames, ignore_index=True)
+        if not dataframe["timestamp"].is_monotonic_increasing:
+            dataframe = dataframe.sort_values(
+                by="timestamp", kind="stable", ignore_index=True)
+        with self._lock:
+            self._offset = offset
+            self._dataframe = dataframe
+            self.version += 1
+        log(f"Loaded {n_new} new failures ({len(self)} in total)")
+        return n_new
+
+    def window(self, range_start: str, range_end: str) -> Tuple[int, pd.DataFrame]:
+        """
+        Returns the failures in `[range_start, range_end]`, with the same
+        semantics as `shape_challenge.transform.filter_range`.
+
+        Args:
+            range_start (str): Minimum timestamp.
+            range_end (str): Maximum timestamp.
+
+        Returns:
+            A tuple with the dataset version and the failures in the range,
+            or `None` if nothing has been loaded yet.
+        """
+        with self._lock:
+            version, dataframe = self.version, self._dataframe
+        if dataframe is None:
+            return version, None
+        timestamps = dataframe["timestamp"]
+        start = timestamps.searchsorted(pd.Timestamp(range_start), side="left")
+        end = timestamps.searchsorted(pd.Timestamp(range_end), side="right")
+        return version, dataframe.iloc[start:end]
+
+    def _compact(self, dataframe: pd.DataFrame) -> pd.DataFrame:
+        return dataframe.astype(self._dtypes)
+
+
+class LRUCache:  # pylint: disable=too-few-public-methods
+    """
+    Thread-safe least-recently-used cache with a maximum number of entries.
+    """
+
+    def __init__(self, max_size: int = 128):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[Hashable, Any]" = OrderedDict()
+
+    def get_or_compute(self, key: Hashable, compute: Callable[[], Any]) -> Tuple[Any, bool]:
+        """
+        Returns the cached value for a key, computing and caching it on a miss.
+
+        Args:
+            key (Hashable): The cache key.
+            compute (Callable[[], Any]): Computes the value on a miss.
+
+        Returns:
+            A tuple with the value and whether it was a cache hit.
+        """
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key], True
+            self.misses += 1
+        value = compute()
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+        return value, False
+
+
+class ReportService:  # pylint: disable=too-few-public-methods
+    """
+    Computes reports for date ranges over a `ReportDataset`, caching them by
+    range and dataset version, so new data never serves stale reports.
+    """
+
+    def __init__(self, dataset: ReportDataset, cache_size: int = 128):
+        self.dataset = dataset
+        self.cache = LRUCache(cache_size)
+
+    def report(self, range_start: str, range_end: str) -> Tuple[Dict[str, Any], bool]:
+        """
+        Returns the report for a date range.
+
+        Args:
+            range_start (str): Start of the range.
+            range_end (str): End of the range.
+
+        Returns:
+            A tuple with the report as a dictionary and whether it came from
+            the cache.
+        """
+        version, dataframe = self.dataset.window(range_start, range_end)
+        # Same dates written differently share the cache entry
+        return self.cache.get_or_compute(
+            (pd.Timestamp(range_start), pd.Timestamp(range_end), version),
+            lambda: self._compute(dataframe, range_start, range_end),
+        )
+
+    @staticmethod
+    def _compute(dataframe: pd.DataFrame, range_start: str, range_end: str) -> Dict[str, Any]:
+        if dataframe is None or dataframe.shape[0] == 0:
+            return {"range_start": range_start, "range_end": range_end,
+                    "total_failures": 0}
+        total_failures = get_total_equipment_failures.run(dataframe=dataframe)
+        equipment_code = get_most_failures_equipment_code.run(
+            dataframe=dataframe)
+        average_failures = get_average_failures_across_equipment_groups.run(
+            dataframe=dataframe)
+        report_text = generate_report.run(
+            output_file_path=None,
+            total_failures=total_failures,
+            most_failures_equipment_code=equipment_code,
+            average_failures_across_equipment_groups=average_failures,
+            range_min=range_start,
+            range_max=range_end,
+        )
+        return {
+            "range_start": range_start,
+            "range_end": range_end,
+            "total_failures": int(total_failures),
+            "most_failures_equipment_code": str(equipment_code),
+            "average_failures_across_equipment_groups": {
+                str(row["equipment_group_name"]): float(row["average_failures"])
+                for _, row in average_failures.iterrows()
+            },
+            "report": report_text,
+        }
+
+
+def make_handler(service: ReportService) -> type:
+    """
+    Builds the HTTP request handler for a report service. Endpoints are:
+
+    - `GET /report?start=<date>&end=<date>`: The report for the range, as JSON.
+        The `X-Cache` header tells whether it was a cache `hit` or `miss`.
+    - `GET /health`: Number of failures loaded, dataset version, number of
+        quarantined lines and cache statistics, as JSON.
+
+    Args:
+        service (ReportService): The service that computes the reports.
+
+    Returns:
+        A `BaseHTTPRequestHandler` subclass.
+    """
+
+    class ReportHandler(BaseHTTPRequestHandler):
+        """
+        Handles report and health requests.
+        """
+
+        def do_GET(self):  # pylint: disable=invalid-name
+            """
+            Dispatches GET requests.
+            """
+            url = urlparse(self.path)
+            query = {key: values[0] for key, values in parse_qs(url.query).items()}
+            if url.path == "/health":
+                self._send(200, {
+                    "failures": len(service.dataset),
+                    "version": service.dataset.version,
+                    "quarantined": service.dataset.quarantine.errors,
+                    "cache_hits": service.cache.hits,
+                    "cache_misses": service.cache.misses,
+                })
+            elif url.path == "/report":
+                if "start" not in query or "end" not in query:
+                    self._send(400, {"error": "start and end are required"})
+                    return
+                try:
+                    report, hit = service.report(query["start"], query["end"])
+                except ValueError as exc:
+                    self._send(400, {"error": str(exc)})
+                    return
+                except Exception as exc:  # pylint: disable=broad-except
+                    log(f"Failed to compute report: {exc!r}", level="error")
+                    self._send(500, {"error": "Internal server error"})
+                    return
+                self._send(200, report, {"X-Cache": "hit" if hit else "miss"})
+            else:
+                self._send(404, {"error": f"Unknown path: {url.path}"})
+
+        def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+            log(format % args, level="debug")
+
+        def _send(self, status: int, body: Dict[str, Any], headers: Dict[str, str] = None):
+            content = json.dumps(body).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(content)))
+            for key, value in (headers or {}).items():
+                self.send_header(key, value)
+            self.end_headers()
+            self.wfile.write(content)
+
+    return ReportHandler
+
+
+# pylint: disable=too-many-arguments,too-many-positional-arguments
+def create_server(
+    failure_logs_path: str,
+    equipment_path: str,
+    equipment_sensors_path: str,
+    host: str = "127.0.0.1",
+    port: int = 8000,
+    cache_size: int = 128,
+    refresh_interval: float = 10.0,
+    dimension_index_path: str = None,
+    quarantine_path: str = None,
+) -> ThreadingHTTPServer:
+    """
+    Loads the data and creates a report server. Call `serve_forever` on the
+    result to start serving. While it runs, a daemon thread refreshes the
+    dataset every `refresh_interval` seconds.
+
+    Args:
+        failure_logs_path (str): Path to the failure logs.
+        equipment_path (str): Path to the equipment information.
+        equipment_sensors_path (str): Path to the equipments and sensors
+            relationships.
+        host (str, optional): Host to bind to.
+        port (int, optional): Port to bind to. Use 0 for any free port.
+        cache_size (int, optional): Maximum number of cached reports.
+        refresh_interval (float, optional): Seconds between refreshes. If
+            `None`, the dataset is never refreshed.
+        dimension_index_path (str, optional): Path to a persisted dimension
+            index (see `shape_challenge.dimensions`).
+        quarantine_path (str, optional): File for the failure log lines that
+            can't be used. If `None`, they're only counted.
+
+    Returns:
+        The HTTP server.
+    """
+    dataset = ReportDataset(failure_logs_path, equipment_path, equipment_sensors_path,
+                            dimension_index_path, quarantine_path)
+    service = ReportService(dataset, cache_size)
+    server = ThreadingHTTPServer((host, port), make_handler(service))
+    server.daemon_threads = True
+    server.service = service
+
+    if refresh_interval is not None:
+        def refresh_periodically():
+            while not stopped.wait(refresh_interval):
+                try:
+                    dataset.refresh()
+                except Exception as exc:  # pylint: disable=broad-except
+                    log(f"Failed to refresh the dataset: {exc!r}", level="error")
+
+        stopped = threading.Event()
+        threading.Thread(target=refresh_periodically, daemon=True).start()
+        server.stop_refreshing = stopped.set
+
+    log(f"Serving reports on http://{host}:{server.server_address[1]}")
+    return server
@@ -0,0 +1,148 @@
+"""
+Memory-budgeted loading of the failure logs. When parsing and merging the
+logs in memory would exceed the budget, they're parsed in chunks instead, and
+each merged chunk is split into partitions by equipment and spilled to disk
+(see `shape_challenge.handoff.PartitionedFrame`). Downstream tasks then
+aggregate one partition at a time and combine the results.
+"""
+
+import math
+from pathlib import Path
+import shutil
+import tempfile
+from typing import Callable, List, Tuple
+import uuid
+
+import numpy as np
+import pandas as pd
+
+from shape_challenge.dimensions import DimensionIndex
+from shape_challenge.handoff import FrameHandle, PartitionedFrame, put_frame
+from shape_challenge.parsing import iter_failure_logs
+from shape_challenge.quarantine import Quarantine
+from shape_challenge.transform import merge_with_dimension_index
+
+# Peak memory of parsing and merging the failure logs in memory, and memory
+# of the merged data, per byte of failure logs.
+PARSE_MEMORY_FACTOR = 10
+MERGED_MEMORY_FACTOR = 3
+
+# Where partitions are spilled if no directory is given
+DEFAULT_SPILL_DIRECTORY = str(Path(tempfile.gettempdir()) / "shape_challenge" / "spill")
+
+# Share of the memory budget for buffering merged rows before spilling them,
+# the rest is for parsing.
+BUFFER_MEMORY_SHARE = 0.5
+
+
+def estimate_working_set(
+    failure_logs_paths: List[str],
+) -> int:
+    """
+    Estimates the peak memory, in bytes, of parsing the failure logs and
+    merging them in memory.
+
+    Args:
+        failure_logs_paths (List[str]): Paths to the failure logs.
+
+    Returns:
+        The estimated peak memory, in bytes.
+    """
+    return PARSE_MEMORY_FACTOR * sum(
+        Path(path).stat().st_size for path in failure_logs_paths)
+
+
+def spill_failure_logs(
+    failure_logs_paths: List[str],
+    dimension_index: DimensionIndex,
+    memory_budget: int,
+    spill_directory: str,
+    make_quarantine: Callable[[str], Quarantine] = None,
+) -> Tuple[PartitionedFrame, List[Quarantine]]:
+    """
+    Parses the failure logs in chunks that fit in the memory budget, merges
+    each chunk with the dimension index and splits it into partitions by
+    equipment. Rows are buffered per partition and spilled to disk when the
+    buffers are full, largest first, so that each partition is written in a
+    few large chunks. Partitions are sized so that each one fits in the
+    memory budget once loaded.
+
+    Args:
+        failure_logs_paths (List[str]): Paths to the failure logs.
+        dimension_index (DimensionIndex): The dimension index.
+        memory_budget (int): The memory budget, in bytes.
+        spill_directory (str): Directory for the partitions. Each call spills
+            to a new subdirectory of it, which is deleted on errors.
+        make_quarantine (Callable[[str], Quarantine], optional): Creates the
+            quarantine for a failure logs file. If `None`, bad lines raise an
+            error.
+
+    Returns:
+        A tuple with the partitioned frame and the quarantine of each file
+        (empty if there's no quarantine).
+    """
+    total_size = sum(Path(path).stat().st_size for path in failure_logs_paths)
+    n_partitions = max(1, math.ceil(MERGED_MEMORY_FACTOR * total_size / memory_budget))
+    buffer_size = int(BUFFER_MEMORY_SHARE * memory_budget)
+    chunk_size = max(1, (memory_budget - buffer_size) // PARSE_MEMORY_FACTOR)
+    buffers = _PartitionBuffers(str(Path(spill_directory) / uuid.uuid4().hex),
+                                n_partitions, buffer_size)
+
+    quarantines = []
+    try:
+        for path in failure_logs_paths:
+            quarantine = make_quarantine(path) if make_quarantine is not None else None
+            for chunk in iter_failure_logs(path, chunk_size, quarantine):
+                buffers.add(merge_with_dimension_index(chunk, dimension_index))
+            if quarantine is not None:
+                quarantines.append(quarantine)
+        buffers.flush()
+    except BaseException:
+        shutil.rmtree(buffers.directory, ignore_errors=True)
+        raise
+    return PartitionedFrame(buffers.directory, buffers.partitions), quarantines
+
+
+class _PartitionBuffers:
+    """
+    Buffers merged rows per partition and spills the largest buffers to
+    `directory` while they don't fit in `buffer_size` bytes.
+    """
+
+    def __init__(self, directory: str, n_partitions: int, buffer_size: int):
+        self.directory = directory
+        self.buffer_size = buffer_size
+        self.partitions: List[List[FrameHandle]] = [[] for _ in range(n_partitions)]
+        self.buffers: List[List[pd.DataFrame]] = [[] for _ in range(n_partitions)]
+        self.buffered = np.zeros(n_partitions, dtype=np.int64)
+
+    def add(self, dataframe: pd.DataFrame) -> None:
+        """
+        Splits a merged chunk into partitions by equipment and buffers them.
+        """
+        row_size = dataframe.memory_usage(deep=True).sum() / max(1, dataframe.shape[0])
+        equipment_ids = dataframe["equipment_id"].fillna(0).to_numpy(dtype=np.int64)
+        partition_ids = equipment_ids % len(self.partitions)
+        for partition_id in np.unique(partition_ids):
+            partition = dataframe[partition_ids == partition_id]
+            self.buffers[partition_id].append(partition)
+            self.buffered[partition_id] += int(row_size * partition.shape[0])
+        while self.buffered.sum() > self.buffer_size:
+            self.spill(int(self.buffered.argmax()))
+
+    def flush(self) -> None:
+        """
+        Spills all buffered rows.
+        """
+        for partition_id, buffer in enumerate(self.buffers):
+            if buffer:
+                self.spill(partition_id)
+
+    def spill(self, partition_id: int) -> None:
+        """
+        Spills the buffered rows of a partition as a new chunk of it.
+        """
+        partition = pd.concat(self.buffers[partition_id], ignore_index=True)
+        self.partitions[partition_id].append(put_frame(partition, self.directory))
+        self.buffers[partition_id] = []
+        self.buffered[partition_id] = 0
@@ -0,0 +1,326 @@
+"""
+Online statistics for the sensor measurements. Everything here is computed in
+a single pass over the data, uses bounded memory and can be merged, so it works
+over chunked or parallel input.
+"""
+
+from typing import Dict, Hashable, Iterable, List, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+DEFAULT_SKETCH_CAPACITY = 1024
+DEFAULT_QUANTILES = (0.5, 0.95)
+MEASUREMENT_COLUMNS = ("temperature", "vibration")
+
+
+class QuantileSketch:
+    """
+    Bounded-memory sketch for approximate quantiles (KLL). Samples are kept
+    in levels, where each sample of level `h` stands for `2 ** h` values.
+    When the sketch grows past its capacity, the lowest full level is sorted
+    and every other sample, starting at a random one, is promoted to the next
+    level. Only samples of the same weight are compacted together, so the
+    rank error stays within about `1.7 / capacity` whatever the order of the
+    values. Quantiles are exact while no compaction has happened. Two
+    sketches can be merged level by level, and hold about `3 * capacity`
+    samples.
+    """
+
+    def __init__(self, capacity: int = DEFAULT_SKETCH_CAPACITY, seed: int = 0):
+        if capacity < 2:
+            raise ValueError("capacity must be at least 2")
+        self.capacity = capacity
+        self._levels: List[np.ndarray] = [np.empty(0, dtype=np.float64)]
+        # Seeded, so the same input always gives the same quantiles
+        self._random = np.random.default_rng(seed)
+
+    def __len__(self) -> int:
+        return sum(level.size for level in self._levels)
+
+    def update(self, values: np.ndarray) -> None:
+        """
+        Adds the given values to the sketch, each with weight 1.
+
+        Args:
+            values (np.ndarray): Values to add. Must not contain NaN.
+        """
+        values = np.asarray(values, dtype=np.float64)
+        self._levels[0] = np.concatenate([self._levels[0], values])
+        self._compress()
+
+    def merge(self, other: "QuantileSketch") -> None:
+        """
+        Merges another sketch into this one.
+
+        Args:
+            other (QuantileSketch): The sketch to merge.
+        """
+        # pylint: disable=protected-access
+        for height, level in enumerate(other._levels):
+            if height == len(self._levels):
+                self._levels.append(np.empty(0, dtype=np.float64))
+            self._levels[height] = np.concatenate([self._levels[height], level])
+        self._compress()
+
+    def quantile(self, quantile: float) -> float:
+        """
+        Returns the approximate value for the given quantile, using the
+        lowest value whose cumulative weight reaches it.
+
+        Args:
+            quantile (float): The quantile, between 0 and 1.
+
+        Returns:
+            The approximate quantile value, or NaN if the sketch is empty.
+        """
+        if not 0 <= quantile <= 1:
+            raise ValueError(f"Invalid quantile: {quantile}")
+        if len(self) == 0:
+            return float("nan")
+        values = np.concatenate(self._levels)
+        weights = np.concatenate([np.full(level.size, 2 ** height, dtype=np.int64)
+                                  for height, level in enumerate(self._levels)])
+        order = np.argsort(values, kind="stable")
+        cumulative = np.cumsum(weights[order])
+        position = np.searchsorted(cumulative, quantile * cumulative[-1])
+        return float(values[order][min(position, order.size - 1)])
+
+    def _level_capacity(self, height: int) -> int:
+        # Lower levels get geometrically smaller, the top one holds `capacity`
+        depth = len(self._levels) - 1 - height
+        return max(2, int(np.ceil(self.capacity * (2 / 3) ** depth)))
+
+    def _compress(self) -> None:
+        while len(self) > sum(self._level_capacity(height)
+                              for height in range(len(self._levels))):
+            height = next(height for height, level in enumerate(self._levels)
+                          if level.size >= self._level_capacity(height))
+            if height + 1 == len(self._levels):
+                self._levels.append(np.empty(0, dtype=np.float64))
+            level = np.sort(self._levels[height])
+            # An odd sample out stays in this level
+            paired = level.size - level.size % 2
+            promoted = level[self._random.integers(2):paired:2]
+            self._levels[height] = level[paired:]
+            self._levels[height + 1] = np.concatenate([self._levels[height + 1], promoted])
+
+
+class MeasurementStatistics:
+    """
+    Running statistics of measurement columns grouped by a key column (e.g.
+    `sensor_id`, `equipment_code` or `equipment_group_name`). Memory grows
+    with the number of distinct keys, not with the number of rows.
+
+    Moments, minimum and maximum are kept as arrays indexed by key and
+    updated with vectorized grouped reductions. Quantile sketches take about
+    `3 * sketch_capacity` samples per key and measurement, so they're only
+    kept if `quantiles` is set, which is meant for key columns with few
+    distinct values.
+    """
+
+    def __init__(
+        self,
+        key_column: str,
+        value_columns: Sequence[str] = MEASUREMENT_COLUMNS,
+        sketch_capacity: int = DEFAULT_SKETCH_CAPACITY,
+        quantiles: bool = True,
+    ):
+        self.key_column = key_column
+        self.value_columns = tuple(value_columns)
+        self.sketch_capacity = sketch_capacity
+        self.quantiles = quantiles
+        self._keys = pd.Index([])
+        self._moments: Dict[str, Dict[str, np.ndarray]] = {
+            column: _empty_moments(0) for column in self.value_columns
+        }
+        self._sketches: Dict[Tuple[Hashable, str], QuantileSketch] = {}
+
+    def update(self, dataframe: pd.DataFrame) -> None:
+        """
+        Adds a chunk of rows. Rows with a missing key are ignored.
+
+        Args:
+            dataframe (pd.DataFrame): Chunk with the key and value columns.
+        """
+        codes, keys = pd.factorize(dataframe[self.key_column], sort=False)
+        valid = codes >= 0
+        codes = codes[valid]
+        rows = self._rows(pd.Index(np.asarray(keys)))
+        for column in self.value_columns:
+            values = dataframe[column].to_numpy(dtype=np.float64)[valid]
+            known = ~np.isnan(values)
+            column_codes, values = codes[known], values[known]
+            moments = _grouped_moments(column_codes, values, len(keys))
+            present = moments["count"] > 0
+            self._combine(column, rows[present],
+                          {name: array[present] for name, array in moments.items()})
+            if self.quantiles:
+                order = np.argsort(column_codes, kind="stable")
+                boundaries = np.flatnonzero(np.diff(column_codes[order])) + 1
+                for group in np.split(order, boundaries):
+                    if group.size > 0:
+                        self._sketch(self._keys[rows[column_codes[group[0]]]],
+                                     column).update(values[group])
+
+    def merge(self, other: "MeasurementStatistics") -> None:
+        """
+        Merges statistics computed over another part of the data.
+
+        Args:
+            other (MeasurementStatistics): Statistics with the same key column.
+        """
+        if other.key_column != self.key_column:
+            raise ValueError(
+                f"Cannot merge statistics by {other.key_column} into "
+                f"statistics by {self.key_column}")
+        # pylint: disable=protected-access
+        rows = self._rows(other._keys)
+        for column in self.value_columns:
+            moments = other._moments[column]
+            present = moments["count"] > 0
+            self._combine(column, rows[present],
+                          {name: array[present] for name, array in moments.items()})
+        if self.quantiles:
+            for (key, column), sketch in other._sketches.items():
+                self._sketch(key, column).merge(sketch)
+
+    def to_frame(
+        self,
+        quantiles: Sequence[float] = DEFAULT_QUANTILES,
+    ) -> pd.DataFrame:
+        """
+        Returns the statistics as a dataframe with one row per key and
+        measurement, sorted by both.
+
+        Args:
+            quantiles (Sequence[float], optional): Quantiles to include. They
+                are NaN if the statistics were computed without quantiles.
+
+        Returns:
+            A pandas dataframe. Columns are the key column, `measurement`,
+            `count`, `mean`, `std`, `min`, one column per quantile and `max`.
+        """
+        frames = []
+        for column in self.value_columns:
+            moments = self._moments[column]
+            count = moments["count"]
+            has_values = count > 0
+            frame = pd.DataFrame({
+                self.key_column: self._keys,
+                "measurement": column,
+                "count": count,
+                "mean": np.where(has_values, moments["mean"], np.nan),
+                "std": np.sqrt(np.divide(
+                    moments["m2"], count - 1, out=np.full(count.size, np.nan),
+                    where=count > 1)),
+                "min": np.where(has_values, moments["minimum"], np.nan),
+            })
+            for quantile in quantiles:
+                frame[f"p{quantile * 100:g}"] = [
+                    self._sketches[(key, column)].quantile(quantile)
+                    if (key, column) in self._sketches else float("nan")
+                    for key in self._keys
+                ]
+            frame["max"] = np.where(has_values, moments["maximum"], np.nan)
+            frames.append(frame)
+        dataframe = pd.concat(frames, ignore_index=True)
+        return dataframe.sort_values(
+            by=[self.key_column, "measurement"]).reset_index(drop=True)
+
+    def _rows(self, keys: pd.Index) -> np.ndarray:
+        """
+        Returns the row of each key, adding the keys not seen yet.
+        """
+        rows = self._keys.get_indexer(keys)
+        new = rows < 0
+        if new.any():
+            size = len(self._keys)
+            self._keys = self._keys.append(keys[new]) if size else keys[new]
+            rows[new] = np.arange(size, len(self._keys))
+            for column in self.value_columns:
+                added = _empty_moments(int(new.sum()))
+                self._moments[column] = {
+                    name: np.concatenate([array, added[name]])
+                    for name, array in self._moments[column].items()
+                }
+        return rows
+
+    def _combine(self, column: str, rows: np.ndarray, moments: Dict[str, np.ndarray]) -> None:
+        # Chan's parallel algorithm, for all the rows at once
+        current = self._moments[column]
+        count = current["count"][rows]
+        total = count + moments["count"]
+        delta = moments["mean"] - current["mean"][rows]
+        current["mean"][rows] += delta * moments["count"] / total
+        current["m2"][rows] += moments["m2"] + delta ** 2 * count * moments["count"] / total
+        current["count"][rows] = total
+        current["minimum"][rows] = np.minimum(current["minimum"][rows], moments["minimum"])
+        current["maximum"][rows] = np.maximum(current["maximum"][rows], moments["maximum"])
+
+    def _sketch(self, key: Hashable, column: str) -> QuantileSketch:
+        if (key, column) not in self._sketches:
+            self._sketches[(key, column)] = QuantileSketch(self.sketch_capacity)
+        return self._sketches[(key, column)]
+
+
+def _empty_moments(size: int) -> Dict[str, np.ndarray]:
+    return {
+        "count": np.zeros(size, dtype=np.int64),
+        "mean": np.zeros(size),
+        "m2": np.zeros(size),
+        "minimum": np.full(size, np.inf),
+        "maximum": np.full(size, -np.inf),
+    }
+
+
+def _grouped_moments(codes: np.ndarray, values: np.ndarray, n_groups: int) -> Dict[str, np.ndarray]:
+    """
+    Count, mean, sum of squared deviations, minimum and maximum of the
+    values of each group.
+    """
+    count = np.bincount(codes, minlength=n_groups)
+    mean = np.divide(np.bincount(codes, weights=values, minlength=n_groups), count,
+                     out=np.zeros(n_groups), where=count > 0)
+    m2 = np.bincount(codes, weights=(values - mean[codes]) ** 2, minlength=n_groups)
+    minimum = np.full(n_groups, np.inf)
+    np.minimum.at(minimum, codes, values)
+    maximum = np.full(n_groups, -np.inf)
+    np.maximum.at(maximum, codes, values)
+    return {"count": count, "mean": mean, "m2": m2, "minimum": minimum, "maximum": maximum}
+
+
+def compute_measurement_statistics(
+    chunks: Iterable[pd.DataFrame],
+    key_columns: Sequence[str],
+    value_columns: Sequence[str] = MEASUREMENT_COLUMNS,
+    sketch_capacity: int = DEFAULT_SKETCH_CAPACITY,
+    quantile_key_columns: Sequence[str] = None,
+) -> Dict[str, MeasurementStatistics]:
+    """
+    Computes measurement statistics for several key columns in a single pass
+    over the chunks.
+
+    Args:
+        chunks (Iterable[pd.DataFrame]): Chunks of merged failure data.
+        key_columns (Sequence[str]): Columns to group the statistics by.
+        value_columns (Sequence[str], optional): Measurement columns.
+        sketch_capacity (int, optional): Capacity of the quantile sketches.
+        quantile_key_columns (Sequence[str], optional): Key columns to
+            compute approximate quantiles for. Defaults to all of them.
+
+    Returns:
+        A dictionary mapping each key column to its statistics.
+    """
+    if quantile_key_columns is None:
+        quantile_key_columns = key_columns
+    statistics = {
+        key_column: MeasurementStatistics(
+            key_column, value_columns, sketch_capacity,
+            quantiles=key_column in quantile_key_columns)
+        for key_column in key_columns
+    }
+    for chunk in chunks:
+        for key_statistics in statistics.values():
+            key_statistics.update(chunk)
+    return statistics
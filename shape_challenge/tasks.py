@@ -3,101 +3,248 @@ Task definitions for the data flow. This is where the actual work is done.
 (This is where the magic happens.)
 """
 
+from functools import partial
+import hashlib
+import os
 from pathlib import Path
-import shutil
-from typing import Any, List
+import tempfile
+from typing import Any, Dict, List, Tuple, Union
 
 import pandas as pd
 from prefect import task
+from prefect.triggers import all_finished
 import requests
 
+from shape_challenge.delivery import (
+    WebhookSink,
+    close_dispatchers,
+    get_dispatcher,
+    in_worker_process,
+)
+from shape_challenge.dimensions import (
+    DimensionIndex,
+    load_or_build_dimension_index,
+)
+from shape_challenge.handoff import (
+    FrameHandle,
+    PartitionedFrame,
+    iter_frames,
+    put_frame,
+    release_frame,
+    resolve_frame,
+)
 from shape_challenge.logging import (
     log,
 )
 from shape_challenge.parsing import (
-    parse_equipment_sensors_relationship,
+    expand_paths,
     parse_failure_logs,
 )
+from shape_challenge.quarantine import (
+    Quarantine,
+)
+from shape_challenge.spill import (
+    DEFAULT_SPILL_DIRECTORY,
+    estimate_working_set,
+    spill_failure_logs,
+)
+from shape_challenge.statistics import (
+    compute_measurement_statistics,
+)
+from shape_challenge.timeseries import (
+    FailureSeries,
+    bucket_failure_counts,
+    combine_failure_series,
+)
 from shape_challenge.transform import (
     filter_range,
-    merge_data,
+    merge_with_dimension_index,
 )
 
+# What the tasks that take the merged data accept: a dataframe, a handoff
+# handle or a spilled partitioned frame
+Frame = Union[pd.DataFrame, FrameHandle, PartitionedFrame]
+
+
+@task
+def deliver_report(
+    report_text: str,
+    sinks: Union[str, List[str]] = None,
+    discord_webhook_url: str = None,
+    timeout: float = 30.0,
+) -> int:
+    """
+    Queues the report for delivery in the background and returns right
+    away, so slow or throttling sinks don't hold up the flow. Queued reports
+    are delivered by `flush_report_deliveries` at the latest. See
+    `shape_challenge.delivery`.
+
+    In worker processes of a process-based executor, the report is delivered
+    before returning instead, as the background thread would not outlive the
+    task.
+
+    Args:
+        report_text (str): The report text.
+        sinks (Union[str, List[str]], optional): Where to deliver the report:
+            `stdout`, a webhook URL or a file path (see
+            `shape_challenge.delivery.make_sink`).
+        discord_webhook_url (str, optional): A Discord webhook URL, added to
+            the sinks.
+        timeout (float, optional): Seconds by which the report must be
+            delivered, or it's given up on.
 
-@task(nout=3)
+    Returns:
+        The number of sinks the report was queued for, which is 0 if the
+        delivery queue stayed full for the whole timeout.
+    """
+    if isinstance(sinks, str):
+        sinks = [sinks]
+    sinks = list(sinks or [])
+    if discord_webhook_url is not None:
+        sinks.append(discord_webhook_url)
+    if not sinks:
+        return 0
+    if not get_dispatcher(sinks, timeout).submit(report_text):
+        return 0
+    log(f"Queued report for delivery to {len(sinks)} sinks.")
+    if in_worker_process():
+        close_dispatchers(timeout)
+    return len(sinks)
+
+
+@task
 def download_data(
     url_or_path: str,
     directory_prefix: str = None,
 ) -> str:
     """
-    Downloads a file to `/tmp/<directory_prefix>/<filename>`.
-    The directory is created if it does not exist.
+    Downloads a file to `/tmp/<directory_prefix>/`, under a name that starts
+    with a hash of the URL and ends with its original filename. Files with
+    the same name from different URLs never overwrite each other, while
+    downloading the same URL again replaces the previous download. The
+    directory is created if it does not exist. Local files are used where
+    they are, without copying.
 
     Args:
-        url (str): URL to the file.
+        url_or_path (str): URL or path to the file.
         directory_prefix (str, optional): Prefix for the directory.
 
     Returns:
-        The path to the downloaded file.
+        The path to the downloaded or local file.
     """
-    # Check if it's a file or a URL
+    # Local files are read in place
     if Path(url_or_path).is_file():
-        # It's a file, let's just copy it to a temporary directory
-        filename = Path(url_or_path).name
-        filepath = Path(f"/tmp/{directory_prefix}/{filename}")
-        filepath.parent.mkdir(parents=True, exist_ok=True)
-        log(f"Copying {url_or_path} to {filepath}")
-        shutil.copy(url_or_path, filepath)
-    else:
-        # Splits URL and gets filename
-        filename: str = url_or_path.split("/")[-1]
+        log(f"Using local file {url_or_path}")
+        return url_or_path
 
-        # Adds prefix to directory name if given
-        if directory_prefix is not None:
-            directory = Path(f"/tmp/{directory_prefix}")
-        else:
-            directory = Path("/tmp")
+    # Splits URL and gets filename
+    filename: str = url_or_path.split("/")[-1]
+
+    # Adds prefix to directory name if given
+    if directory_prefix is not None:
+        directory = Path(f"/tmp/{directory_prefix}")
+    else:
+        directory = Path("/tmp")
 
-        # Creates directory if it does not exist
-        directory.mkdir(parents=True, exist_ok=True)
-        filepath = directory / filename
+    # Creates directory if it does not exist
+    directory.mkdir(parents=True, exist_ok=True)
 
-        # Downloads file
-        log(f"Downloading file from {url_or_path} to {filepath}...")
-        response = requests.get(url_or_path)
+    # Downloads file
+    log(f"Downloading file from {url_or_path} to {directory}...")
+    response = requests.get(url_or_path)
 
-        # Saves file to directory
-        with open(filepath, "w", encoding="utf-8") as file:
+    # Saves file to directory, through a temporary file so that concurrent
+    # downloads of the same URL never see each other's partial files
+    url_hash = hashlib.sha1(url_or_path.encode("utf-8")).hexdigest()[:8]
+    filepath = directory / f"{url_hash}_{filename}"
+    file_descriptor, temporary_path = tempfile.mkstemp(suffix=".tmp", dir=directory)
+    try:
+        with open(file_descriptor, "w", encoding="utf-8") as file:
             file.write(response.text)
+        os.replace(temporary_path, filepath)
+    except BaseException:
+        Path(temporary_path).unlink(missing_ok=True)
+        raise
 
     return str(filepath)
 
 
+@task
+def expand_failure_logs(
+    url_or_paths: Union[str, List[str]],
+) -> List[str]:
+    """
+    Expands the failure logs input, which can be a URL, a path, a directory,
+    a glob pattern or a list of them, into the list of files to load. See
+    `shape_challenge.parsing.expand_paths`.
+
+    Args:
+        url_or_paths (Union[str, List[str]]): The failure logs input.
+
+    Returns:
+        The URLs and paths of the failure logs files.
+    """
+    paths = expand_paths(url_or_paths)
+    log(f"Found {len(paths)} failure logs files.")
+    return paths
+
+
 @task(checkpoint=False)
 def filter_data(
-    dataframe: pd.DataFrame,
+    dataframe: Frame,
     filter_column: str,
     range_start: float,
     range_end: float,
-) -> pd.DataFrame:
+    handoff_directory: str = None,
+) -> Frame:
     """
     Filters a range within a dataframe column.
 
     Args:
-        dataframe (pd.DataFrame): Dataframe to filter.
+        dataframe (Frame): Dataframe to filter.
         filter_column (str): Column to filter.
         range_start (float): Minimum value for the range.
         range_end (float): Maximum value for the range.
+        handoff_directory (str, optional): If given, the filtered dataframe is
+            stored there and a handle to it is returned (see
+            `shape_challenge.handoff`).
 
     Returns:
-        A filtered dataframe.
+        A filtered dataframe, or a handle to it. Partitioned frames are
+        filtered one partition at a time and stay partitioned.
     """
     log(
         f"Filtering dataframe by {filter_column} and range [{range_start}, {range_end}]")
-    return filter_range(dataframe, filter_column, range_start, range_end)
+    if isinstance(dataframe, PartitionedFrame):
+        dataframe = dataframe.map(
+            lambda chunk: filter_range(chunk, filter_column, range_start, range_end))
+        log(f"filter_data spilled {len(dataframe.partitions)} partitions "
+            f"({dataframe.nbytes / 2**20:.1f}MiB) to {dataframe.directory}")
+        return dataframe
+    dataframe = filter_range(resolve_frame(dataframe), filter_column, range_start, range_end)
+    if handoff_directory is not None:
+        return put_frame(dataframe, handoff_directory)
+    return dataframe
+
+
+@task(trigger=all_finished, skip_on_upstream_skip=False)
+def flush_report_deliveries(
+    timeout: float = 30.0,
+) -> None:
+    """
+    Waits for the reports queued by `deliver_report` to be delivered, at
+    most `timeout` seconds. Runs whether the upstream tasks succeeded, failed
+    or were skipped, so queued reports are never dropped with the process.
+    Undelivered reports are logged, not raised.
+
+    Args:
+        timeout (float, optional): Maximum seconds to wait.
+    """
+    close_dispatchers(timeout)
 
 
-@task
+# Runs when the optional measurement statistics are skipped, and gets None
+@task(skip_on_upstream_skip=False)
 # pylint: disable=too-many-arguments
 def generate_report(
     output_file_path: str,
@@ -106,15 +253,21 @@ def generate_report(
     average_failures_across_equipment_groups: pd.DataFrame,
     range_min: str,
     range_max: str,
+    measurement_statistics: pd.DataFrame = None,
 ) -> str:
     """
     Generates a report and save it locally.
 
     Args:
+        output_file_path (str): Where to save the report. If `None`, the
+            report is only returned.
         total_failures (int): Total number of failures.
         most_failures_equipment_code (str): Equipment code with the most failures.
         average_failures_across_equipment_groups (pd.DataFrame): Average failures
             across equipment groups.
+        measurement_statistics (pd.DataFrame, optional): Measurement statistics
+            by equipment group, as returned by `get_measurement_statistics`.
+            If given, a section with them is added to the report.
 
     Returns:
         The report text.
@@ -127,41 +280,51 @@ def generate_report(
     report += "- Average failures across equipment groups:\n"
     for _, row in average_failures_across_equipment_groups.iterrows():
         report += f"\t* {row['equipment_group_name']}: {row['average_failures']}\n"
-    output_file = Path(output_file_path)
-    output_file.parent.mkdir(parents=True, exist_ok=True)
-    with open(output_file_path, "w", encoding="utf-8") as file:
-        file.write(report)
+    if measurement_statistics is not None:
+        report += "- Measurement statistics across equipment groups:\n"
+        statistic_columns = [column for column in measurement_statistics.columns
+                             if column not in ("equipment_group_name", "measurement")]
+        for group_name, group in measurement_statistics.groupby("equipment_group_name"):
+            report += f"\t* {group_name}:\n"
+            for _, row in group.iterrows():
+                values = ", ".join(
+                    f"{column}={round(row[column], 2)}" for column in statistic_columns)
+                report += f"\t\t- {row['measurement']}: {values}\n"
+    if output_file_path is not None:
+        output_file = Path(output_file_path)
+        output_file.parent.mkdir(parents=True, exist_ok=True)
+        with open(output_file_path, "w", encoding="utf-8") as file:
+            file.write(report)
     return report
 
 
 @task(checkpoint=False)
 def get_average_failures_across_equipment_groups(
-    dataframe: pd.DataFrame,
+    dataframe: Frame,
 ) -> pd.DataFrame:
     """
     Gets the average number of failures for each equipment group, ordered
     by the number of failures in ascending order.
 
     Args:
-        dataframe (pd.DataFrame): Dataframe to filter.
+        dataframe (Frame): Dataframe to filter.
 
     Returns:
         A dataframe with the average number of failures for each
         equipment group.
     """
-    # Count equipments per group
-    dataframe_count = dataframe.groupby("equipment_group_name"
-                                        ).agg({"equipment_code": "nunique"}).rename(
-        columns={"equipment_code": "equipment_count"}).reset_index()
-
-    # Count failures per group
-    dataframe_failures = dataframe.groupby("equipment_group_name"
-                                           ).count()[["sensor_id"]].rename(
-        columns={"sensor_id": "failure_count"}).reset_index()
-
-    # Merge dataframes
-    dataframe_merged = pd.merge(dataframe_count, dataframe_failures,
-                                on="equipment_group_name")
+    # Count equipments and failures per group, one partition at a time.
+    # Equipments never span partitions, so their counts add up
+    partial_counts = [
+        partition.groupby("equipment_group_name", observed=True).agg(
+            equipment_count=("equipment_code", "nunique"),
+            failure_count=("sensor_id", "count"),
+        )
+        for partition in iter_frames(
+            dataframe, columns=["equipment_group_name", "equipment_code", "sensor_id"])
+    ]
+    dataframe_merged = pd.concat(partial_counts).groupby(
+        level=0, observed=True).sum().reset_index()
 
     # Calculate average failures per group
     dataframe_merged["average_failures"] = dataframe_merged[
@@ -181,39 +344,154 @@ def get_average_failures_across_equipment_groups(
     return dataframe_merged
 
 
+@task(checkpoint=False)
+def get_failure_series(
+    dataframe: Frame,
+    frequency: str,
+    range_start: str,
+    range_end: str,
+    key_columns: List[str] = None,
+) -> Dict[str, FailureSeries]:
+    """
+    Gets failure counts per time bucket for every equipment and equipment
+    group, in a single vectorized pass (see `shape_challenge.timeseries`).
+
+    Args:
+        dataframe (Frame): Dataframe with the equipment failures.
+        frequency (str): Width of each bucket, e.g. `1h` or `1D`.
+        range_start (str): Start of the first bucket.
+        range_end (str): Last instant covered by the buckets.
+        key_columns (List[str], optional): Columns to count failures by.
+            Defaults to `equipment_code` and `equipment_group_name`.
+
+    Returns:
+        A dictionary mapping each key column to its failure series.
+    """
+    if key_columns is None:
+        key_columns = ["equipment_code", "equipment_group_name"]
+    log(f"Counting failures per {frequency} by {', '.join(key_columns)}...")
+    if isinstance(dataframe, PartitionedFrame):
+        # Partitions must share the same buckets to be added up
+        if range_start is None or range_end is None:
+            timestamps = [partition["timestamp"] for partition in
+                          iter_frames(dataframe, columns=["timestamp"])]
+            range_start = range_start or min(series.min() for series in timestamps)
+            range_end = range_end or max(series.max() for series in timestamps)
+        partial_series = [
+            bucket_failure_counts(partition, key_columns, frequency, range_start, range_end)
+            for partition in iter_frames(dataframe, columns=["timestamp", *key_columns])
+        ]
+        failure_series = {
+            key_column: combine_failure_series(
+                [series[key_column] for series in partial_series])
+            for key_column in key_columns
+        }
+    else:
+        dataframe = resolve_frame(dataframe, columns=["timestamp", *key_columns])
+        failure_series = bucket_failure_counts(
+            dataframe, key_columns, frequency, range_start, range_end)
+    for key_column, series in failure_series.items():
+        log(f"Failure series by {key_column} has shape {series.counts.shape}")
+    return failure_series
+
+
+@task(checkpoint=False)
+def get_measurement_statistics(
+    dataframe: Frame,
+    output_directory: str = None,
+    key_columns: List[str] = None,
+    chunk_size: int = 1_000_000,
+    quantile_key_columns: List[str] = None,
+) -> Dict[str, pd.DataFrame]:
+    """
+    Gets count, mean, standard deviation, minimum, maximum and approximate
+    quantiles of the temperature and vibration measurements. The dataframe
+    is consumed in chunks by a single-pass, mergeable statistics engine (see
+    `shape_challenge.statistics`).
+
+    Args:
+        dataframe (Frame): Dataframe with the equipment failures.
+        output_directory (str, optional): If given, the statistics by each
+            key column are also saved there, as
+            `measurement_statistics_by_<key_column>.csv`.
+        key_columns (List[str], optional): Columns to group the statistics by.
+            Defaults to `sensor_id`, `equipment_code` and `equipment_group_name`
+            if there's an output directory, and only to `equipment_group_name`,
+            which is the one in the report, otherwise.
+        chunk_size (int, optional): Number of rows in each chunk.
+        quantile_key_columns (List[str], optional): Key columns to compute
+            approximate quantiles for, which take memory per key. Defaults to
+            `equipment_code` and `equipment_group_name`.
+
+    Returns:
+        A dictionary mapping each key column to a dataframe with its
+        measurement statistics.
+    """
+    if key_columns is None:
+        key_columns = ["equipment_group_name"]
+        if output_directory is not None:
+            key_columns = ["sensor_id", "equipment_code", *key_columns]
+    log(f"Computing measurement statistics by {', '.join(key_columns)}...")
+    chunks = (partition.iloc[start:start + chunk_size]
+              for partition in iter_frames(
+                  dataframe, columns=[*key_columns, "temperature", "vibration"])
+              for start in range(0, partition.shape[0], chunk_size))
+    if quantile_key_columns is None:
+        quantile_key_columns = ["equipment_code", "equipment_group_name"]
+    statistics = compute_measurement_statistics(
+        chunks, key_columns, quantile_key_columns=quantile_key_columns)
+    frames = {
+        key_column: key_statistics.to_frame()
+        for key_column, key_statistics in statistics.items()
+    }
+    if output_directory is not None:
+        Path(output_directory).mkdir(parents=True, exist_ok=True)
+        paths = []
+        for key_column, frame in frames.items():
+            path = Path(output_directory) / f"measurement_statistics_by_{key_column}.csv"
+            frame.to_csv(path, index=False)
+            paths.append(str(path))
+        log(f"Saved measurement statistics to {', '.join(paths)}")
+    return frames
+
+
 @task
 def get_most_failures_equipment_code(
-    dataframe: pd.DataFrame,
+    dataframe: Frame,
 ) -> str:
     """
     Gets the equipment code with the most failures.
 
     Args:
-        dataframe (pd.DataFrame): Dataframe to filter.
+        dataframe (Frame): Dataframe to filter.
 
     Returns:
         The equipment code with the most failures.
     """
-    code = dataframe.groupby("equipment_code").count()[
-        "sensor_id"].idxmax()
+    partial_counts = [
+        partition.groupby("equipment_code", observed=True).count()["sensor_id"]
+        for partition in iter_frames(dataframe, columns=["equipment_code", "sensor_id"])
+    ]
+    code = pd.concat(partial_counts).groupby(level=0, observed=True).sum().idxmax()
     log(f"The equipment code with the most failures is {code}")
     return code
 
 
 @task
 def get_total_equipment_failures(
-    dataframe: pd.DataFrame,
+    dataframe: Frame,
 ) -> int:
     """
     Returns the total number of equipment failures.
 
     Args:
-        dataframe (pd.DataFrame): Dataframe with the equipment failures.
+        dataframe (Frame): Dataframe with the equipment failures.
 
     Returns:
         The total number of equipment failures.
     """
-    total = dataframe.shape[0]
+    total = sum(partition.shape[0]
+                for partition in iter_frames(dataframe, columns=["sensor_id"]))
     log(f"Total number of equipment failures: {total}")
     return total
 
@@ -235,48 +513,289 @@ def is_none(
 
 
 @task(checkpoint=False)
-def load_data(
-    filenames: List[str],
-) -> pd.DataFrame:
+def load_dimension_index(
+    equipment_path: str,
+    sensor_equipment_path: str,
+    index_path: str = None,
+) -> DimensionIndex:
     """
-    Loads data from the downloaded files and returns the merged DataFrame.
+    Loads the equipment information and the equipments and sensors
+    relationships as a dimension index. If an index path is given, the index
+    is reused from there when it's up to date with the files, and saved there
+    otherwise. See `shape_challenge.dimensions`.
 
     Args:
-        filenames: List[str]: Filenames of the downloaded files. It must
-            have length 3 and the following order:
+        equipment_path (str): Path to the equipment information.
+        sensor_equipment_path (str): Path to the equipments and sensors
+            relationships.
+        index_path (str, optional): Path to the persisted dimension index.
 
-            - failure_logs_path (str): Path to the failure logs.
-            - equipment_path (str): Path to the equipment information.
-            - sensor_equipment_path (str): Path to the equipments and
-                sensors relationships.
+    Returns:
+        The dimension index.
+    """
+    dimension_index = load_or_build_dimension_index(
+        equipment_path, sensor_equipment_path, index_path)
+    log(f"Dimension index has {dimension_index.sensor_ids.size} sensors and "
+        f"{dimension_index.equipment_ids.size} equipment.")
+    return dimension_index
+
+
+@task
+def exceeds_memory_budget(
+    failure_logs_paths: List[str],
+    memory_budget_mb: float = None,
+) -> bool:
+    """
+    Tells whether loading the failure logs in memory is estimated to exceed
+    the memory budget, in which case they're spilled to disk by `spill_data`
+    instead of being loaded by `load_failure_logs_file` and `combine_data`.
+
+    Args:
+        failure_logs_paths (List[str]): Paths to the failure logs.
+        memory_budget_mb (float, optional): Memory budget for loading the
+            failure logs, in MiB. If `None`, they're always loaded in memory.
 
     Returns:
-        A tuple with the dataframes.
+        Whether the failure logs must be spilled to disk.
+    """
+    if memory_budget_mb is None:
+        return False
+    working_set = estimate_working_set(failure_logs_paths)
+    if working_set <= memory_budget_mb * 2**20:
+        return False
+    log(f"Loading the failure logs needs about {working_set / 2**20:.0f}MiB, over "
+        f"the budget of {memory_budget_mb}MiB. Spilling them to disk...", level="warning")
+    return True
+
+
+@task(checkpoint=False)
+def load_failure_logs_file(
+    failure_logs_path: str,
+    dimension_index: DimensionIndex,
+    quarantine_directory: str = None,
+    max_quarantined_lines: int = None,
+    handoff_directory: str = None,
+) -> Tuple[Union[pd.DataFrame, FrameHandle], Quarantine]:
+    """
+    Parses a failure logs file and merges it with the equipment information.
+    The task is mapped over the failure logs files, so the executor parses
+    them in parallel, and `combine_data` puts the results together.
+
+    If a quarantine directory is given, bad lines don't abort the run: they
+    are written to `<quarantine_directory>/<filename>.<hash>.quarantine.tsv`
+    instead, where the hash is of the file's full path (see
+    `shape_challenge.quarantine.Quarantine`). The error budget across all
+    files is checked by `combine_data`.
+
+    Args:
+        failure_logs_path (str): Path to the failure logs file.
+        dimension_index (DimensionIndex): Equipment information, as
+            returned by `load_dimension_index`.
+        quarantine_directory (str, optional): Directory for the quarantine
+            files. If `None`, any bad line raises an error.
+        max_quarantined_lines (int, optional): Maximum number of quarantined
+            lines in the file.
+        handoff_directory (str, optional): If given, the merged dataframe is
+            stored there and a handle to it is returned (see
+            `shape_challenge.handoff`).
+
+    Returns:
+        A tuple with the merged dataframe, or a handle to it, and the
+        quarantine of the file (`None` without a quarantine directory).
 
     Raises:
-        AssertionError: If the length of the filenames is not 3.
-        ValueError: If the filenames are in the wrong order.
+        ValueError: If a line can't be parsed and there's no quarantine
+            directory, or if the file's error budget is exceeded.
+    """
+    quarantine = None
+    if quarantine_directory is not None:
+        quarantine = _make_quarantine(failure_logs_path, quarantine_directory,
+                                      max_quarantined_lines)
+    dataframe = merge_with_dimension_index(
+        parse_failure_logs(failure_logs_path, quarantine), dimension_index)
+    log(f"Parsed {dataframe.shape[0]} failures from {failure_logs_path}")
+    if handoff_directory is not None:
+        return put_frame(dataframe, handoff_directory), quarantine
+    return dataframe, quarantine
+
+
+@task(checkpoint=False)
+def combine_data(
+    loaded_files: List[Tuple[Union[pd.DataFrame, FrameHandle], Quarantine]],
+    max_quarantined_lines: int = None,
+    max_quarantined_ratio: float = None,
+    handoff_directory: str = None,
+) -> Frame:
     """
-    # Checks length of filenames
-    if len(filenames) != 3:
-        raise AssertionError("filenames must have length 3")
+    Concatenates the failure logs files loaded by `load_failure_logs_file`
+    into the merged data, after checking the error budget across all files.
+    Handles to the files are released once they're concatenated.
+
+    Args:
+        loaded_files (List[Tuple[Union[pd.DataFrame, FrameHandle], Quarantine]]):
+            The results of `load_failure_logs_file` for each file.
+        max_quarantined_lines (int, optional): Maximum number of quarantined
+            lines across all files.
+        max_quarantined_ratio (float, optional): Maximum ratio of quarantined
+            lines to all lines across all files.
+        handoff_directory (str, optional): If given, the merged dataframe is
+            stored there and a handle to it is returned (see
+            `shape_challenge.handoff`).
+
+    Returns:
+        The merged dataframe, or a handle to it.
 
-    # Tries to load data. If it fails, assumes that filenames is in the
-    # wrong order and raises an error.
+    Raises:
+        ValueError: If the error budget is exceeded.
+    """
+    frames = [frame for frame, _ in loaded_files]
     try:
-        failure_logs = parse_failure_logs(filenames[0])
-        log("Successfully parsed failure logs.")
-        equipment = pd.read_json(filenames[1])
-        log("Successfully parsed equipment information.")
-        sensor_equipment = parse_equipment_sensors_relationship(filenames[2])
-        log("Successfully parsed equipment-sensor relationships.")
-    except Exception as exc:
-        raise ValueError("filenames must be in the following order: "
-                         "failure_logs, equipment, sensor_equipment") from exc
+        _check_quarantine_budget([quarantine for _, quarantine in loaded_files],
+                                 max_quarantined_lines, max_quarantined_ratio)
+        log(f"Merging {len(frames)} failure logs files and returning...")
+        if len(frames) == 1:
+            dataframe = resolve_frame(frames[0])
+        else:
+            dataframe = pd.concat([resolve_frame(frame) for frame in frames],
+                                  ignore_index=True)
+        if handoff_directory is not None:
+            dataframe = put_frame(dataframe, handoff_directory)
+    finally:
+        for frame in frames:
+            release_frame(frame)
+    return dataframe
 
-    # Merges data
-    log("Merging dataframes and returning...")
-    return merge_data(failure_logs, equipment, sensor_equipment)
+
+@task(checkpoint=False)
+# pylint: disable=too-many-arguments,too-many-positional-arguments
+def spill_data(
+    failure_logs_paths: List[str],
+    dimension_index: DimensionIndex,
+    memory_budget_mb: float,
+    spill_directory: str = None,
+    quarantine_directory: str = None,
+    max_quarantined_lines: int = None,
+    max_quarantined_ratio: float = None,
+) -> PartitionedFrame:
+    """
+    Parses the failure logs in chunks, merges them with the equipment
+    information and spills them to disk, partitioned by equipment, so that
+    loading them stays within the memory budget (see
+    `shape_challenge.spill`). The other tasks then aggregate one partition
+    at a time. Quarantines work as in `load_failure_logs_file`.
+
+    Args:
+        failure_logs_paths (List[str]): Paths to the failure logs.
+        dimension_index (DimensionIndex): Equipment information, as
+            returned by `load_dimension_index`.
+        memory_budget_mb (float): Memory budget for loading the failure
+            logs, in MiB.
+        spill_directory (str, optional): Directory for the spilled
+            partitions. Defaults to `shape_challenge.spill.DEFAULT_SPILL_DIRECTORY`.
+        quarantine_directory (str, optional): Directory for the quarantine
+            files. If `None`, any bad line raises an error.
+        max_quarantined_lines (int, optional): Maximum number of quarantined
+            lines across all files.
+        max_quarantined_ratio (float, optional): Maximum ratio of quarantined
+            lines to all lines across all files.
+
+    Returns:
+        The partitioned frame.
+
+    Raises:
+        ValueError: If a line can't be parsed and there's no quarantine
+            directory, or if the error budget is exceeded.
+    """
+    make_quarantine = None
+    if quarantine_directory is not None:
+        make_quarantine = partial(_make_quarantine,
+                                  quarantine_directory=quarantine_directory,
+                                  max_quarantined_lines=max_quarantined_lines)
+    spilled, quarantines = spill_failure_logs(
+        failure_logs_paths, dimension_index, int(memory_budget_mb * 2**20),
+        spill_directory or DEFAULT_SPILL_DIRECTORY, make_quarantine)
+    log(f"spill_data spilled {len(spilled.partitions)} partitions "
+        f"({spilled.nbytes / 2**20:.1f}MiB) to {spilled.directory}")
+    try:
+        _check_quarantine_budget(quarantines, max_quarantined_lines, max_quarantined_ratio)
+    except Exception:
+        release_frame(spilled)
+        raise
+    return spilled
+
+
+def _check_quarantine_budget(
+    file_quarantines: List[Quarantine],
+    max_quarantined_lines: int = None,
+    max_quarantined_ratio: float = None,
+) -> None:
+    # Checks the error budget across all files, if they have a quarantine
+    file_quarantines = [quarantine for quarantine in file_quarantines if quarantine is not None]
+    if not file_quarantines:
+        return
+    quarantine = Quarantine(max_errors=max_quarantined_lines,
+                            max_error_ratio=max_quarantined_ratio)
+    for file_quarantine in file_quarantines:
+        quarantine.merge(file_quarantine)
+    log(f"Quarantined {quarantine.errors} lines ({quarantine.summary()})",
+        level="warning" if quarantine.errors else "info")
+    quarantine.check_budget()
+
+
+def _make_quarantine(
+    fname: str,
+    quarantine_directory: str,
+    max_quarantined_lines: int = None,
+) -> Quarantine:
+    Path(quarantine_directory).mkdir(parents=True, exist_ok=True)
+    # Files with the same name in different directories get their own quarantine
+    path_hash = hashlib.sha1(str(Path(fname).resolve()).encode("utf-8")).hexdigest()[:8]
+    return Quarantine(
+        path=str(Path(quarantine_directory) /
+                 f"{Path(fname).name}.{path_hash}.quarantine.tsv"),
+        max_errors=max_quarantined_lines,
+    )
+
+
+@task(trigger=all_finished, skip_on_upstream_skip=False)
+def release_handoff(
+    frame: Frame,
+) -> None:
+    """
+    Deletes the files behind a handle returned by another task, once all the
+    tasks that use it are finished, whether they succeeded or not. Does
+    nothing if the task returned a dataframe.
+
+    Args:
+        frame (Frame): A dataframe, a handle or a partitioned frame.
+    """
+    release_frame(frame)
+
+
+@task
+def save_failure_series(
+    failure_series: Dict[str, FailureSeries],
+    output_directory: str,
+    frequency: str,
+) -> List[str]:
+    """
+    Saves each failure series as a dense matrix (`.npz`) and in long,
+    columnar form (`.csv`), named `failures_by_<key_column>_<frequency>`.
+
+    Args:
+        failure_series (Dict[str, FailureSeries]): Failure series to save.
+        output_directory (str): Directory for the output files.
+        frequency (str): Width of each bucket, used in the file names.
+
+    Returns:
+        The paths of the saved files.
+    """
+    paths = []
+    for key_column, series in failure_series.items():
+        paths += series.save(
+            output_directory, f"failures_by_{key_column}_{frequency}")
+    log(f"Saved failure series to {', '.join(paths)}")
+    return paths
 
 
 @task
@@ -285,16 +804,17 @@ def send_report_to_discord(
     discord_webhook_url: str,
 ) -> None:
     """
-    Sends the report to the Discord webhook.
+    Sends the report to the Discord webhook and waits for it to be
+    delivered, retrying on rate limits. Prefer `deliver_report`, which
+    doesn't wait.
 
     Args:
         report_text (str): The report text.
         discord_webhook_url (str): The Discord webhook URL.
     """
     log("Sending report to Discord...")
-    requests.post(
-        discord_webhook_url,
-        data={
-            "content": f"```{report_text}```"
-        }
-    )
+    sink = WebhookSink(discord_webhook_url)
+    try:
+        sink.deliver([report_text])
+    finally:
+        sink.close()
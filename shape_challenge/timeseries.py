@@ -0,0 +1,180 @@
+"""
+Time-bucketed failure counts. Timestamps and keys are turned into integer
+bucket ids and key codes, so counting failures for every key and bucket is a
+few `np.bincount` calls instead of a resample per key.
+"""
+
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Sequence
+
+import numpy as np
+import pandas as pd
+
+# Maximum number of int64 counts `np.bincount` returns at once (32 MiB)
+BINCOUNT_BLOCK_SIZE = 1 << 22
+
+
+class FailureSeries(NamedTuple):
+    """
+    Dense matrix of failure counts, one row per key and one column per time
+    bucket.
+
+    Attributes:
+        key_column (str): The column the keys come from, e.g. `equipment_code`.
+        keys (np.ndarray): Sorted keys, one for each row of `counts`.
+        bucket_starts (pd.DatetimeIndex): Start of each bucket, one for each
+            column of `counts`.
+        counts (np.ndarray): Failure counts with shape
+            `(len(keys), len(bucket_starts))`.
+    """
+    key_column: str
+    keys: np.ndarray
+    bucket_starts: pd.DatetimeIndex
+    counts: np.ndarray
+
+    def to_frame(self) -> pd.DataFrame:
+        """
+        Returns the series in long, columnar form. Only buckets with at least
+        one failure are included.
+
+        Returns:
+            A pandas dataframe. Columns are the key column, `bucket_start`
+            and `failures`.
+        """
+        rows, columns = np.nonzero(self.counts)
+        return pd.DataFrame({
+            self.key_column: self.keys[rows],
+            "bucket_start": self.bucket_starts[columns],
+            "failures": self.counts[rows, columns],
+        })
+
+    def save(self, directory: str, name: str) -> List[str]:
+        """
+        Saves the dense matrix to `<directory>/<name>.npz` and the long form
+        to `<directory>/<name>.csv`.
+
+        Args:
+            directory (str): The output directory. Created if it does not exist.
+            name (str): Base name of the output files.
+
+        Returns:
+            The paths of the saved files.
+        """
+        path = Path(directory)
+        path.mkdir(parents=True, exist_ok=True)
+        matrix_path = path / f"{name}.npz"
+        np.savez_compressed(
+            matrix_path,
+            keys=self.keys.astype(str),
+            bucket_starts=self.bucket_starts.to_numpy(dtype="datetime64[ns]"),
+            counts=self.counts,
+        )
+        columnar_path = path / f"{name}.csv"
+        self.to_frame().to_csv(columnar_path, index=False)
+        return [str(matrix_path), str(columnar_path)]
+
+
+def bucket_failure_counts(
+    dataframe: pd.DataFrame,
+    key_columns: Sequence[str],
+    frequency: str = "1h",
+    range_start: str = None,
+    range_end: str = None,
+) -> Dict[str, FailureSeries]:
+    """
+    Counts failures per key and per time bucket for several key columns.
+    Bucket ids are computed once and shared by all key columns. Failures
+    outside `[range_start, range_end]` or with a missing key are ignored.
+
+    Args:
+        dataframe (pd.DataFrame): Dataframe with the equipment failures.
+        key_columns (Sequence[str]): Columns to count failures by.
+        frequency (str, optional): Width of each bucket, e.g. `1h` or `1D`.
+        range_start (str, optional): Start of the first bucket, floored to
+            the frequency. Defaults to the earliest failure.
+        range_end (str, optional): Last instant covered by the buckets.
+            Defaults to the latest failure.
+
+    Returns:
+        A dictionary mapping each key column to its `FailureSeries`.
+    """
+    step = pd.to_timedelta(frequency)
+    timestamps = dataframe["timestamp"]
+    start = pd.Timestamp(range_start) if range_start is not None else timestamps.min()
+    end = pd.Timestamp(range_end) if range_end is not None else timestamps.max()
+    if pd.isna(start) or pd.isna(end) or end < start:
+        start = end = pd.Timestamp(range_start or range_end or 0)
+    start = start.floor(step)
+    n_buckets = (end - start) // step + 1
+    bucket_starts = pd.date_range(start, periods=n_buckets, freq=step)
+
+    # Integer bucket id for every failure
+    buckets = (timestamps.to_numpy(dtype="datetime64[ns]").view(np.int64)
+               - start.value) // step.value
+    in_range = (buckets >= 0) & (buckets < n_buckets)
+
+    failure_series = {}
+    for key_column in key_columns:
+        codes, keys = pd.factorize(dataframe[key_column], sort=True)
+        valid = in_range & (codes >= 0)
+        failure_series[key_column] = FailureSeries(
+            key_column=key_column,
+            keys=np.asarray(keys),
+            bucket_starts=bucket_starts,
+            counts=_count_by_key_and_bucket(
+                codes[valid], buckets[valid], len(keys), n_buckets),
+        )
+    return failure_series
+
+
+def _count_by_key_and_bucket(
+    codes: np.ndarray,
+    buckets: np.ndarray,
+    n_keys: int,
+    n_buckets: int,
+) -> np.ndarray:
+    """
+    Counts the failures of each key code and bucket id into a `uint32`
+    matrix. `np.bincount` returns int64, so it's run over blocks of keys to
+    keep its output small next to the matrix.
+    """
+    counts = np.zeros((n_keys, n_buckets), dtype=np.uint32)
+    order = np.argsort(codes, kind="stable")
+    codes, buckets = codes[order], buckets[order]
+    block_size = max(1, BINCOUNT_BLOCK_SIZE // max(n_buckets, 1))
+    for first_key in range(0, n_keys, block_size):
+        last_key = min(first_key + block_size, n_keys)
+        start, end = np.searchsorted(codes, [first_key, last_key])
+        flat = (codes[start:end].astype(np.int64) - first_key) * n_buckets + buckets[start:end]
+        counts[first_key:last_key] = np.bincount(
+            flat, minlength=(last_key - first_key) * n_buckets,
+        ).reshape(last_key - first_key, n_buckets)
+    return counts
+
+
+def combine_failure_series(
+    failure_series: Sequence[FailureSeries],
+) -> FailureSeries:
+    """
+    Adds up failure series computed over different parts of the data, e.g.
+    partitions. They must have the same key column and buckets.
+
+    Args:
+        failure_series (Sequence[FailureSeries]): The failure series.
+
+    Returns:
+        A failure series with the union of the keys and the summed counts.
+
+    Raises:
+        ValueError: If the key columns or buckets differ.
+    """
+    first = failure_series[0]
+    for series in failure_series[1:]:
+        if (series.key_column != first.key_column or
+                not series.bucket_starts.equals(first.bucket_starts)):
+            raise ValueError("Failure series must have the same key column and buckets")
+    keys = np.unique(np.concatenate([series.keys for series in failure_series]))
+    counts = np.zeros((keys.size, first.bucket_starts.size), dtype=np.uint32)
+    for series in failure_series:
+        counts[np.searchsorted(keys, series.keys)] += series.counts
+    return FailureSeries(first.key_column, keys, first.bucket_starts, counts)
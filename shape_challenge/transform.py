@@ -5,6 +5,8 @@ filtering and aggregating data.
 
 import pandas as pd
 
+from shape_challenge.dimensions import DimensionIndex
+
 
 def filter_range(
     dataframe: pd.DataFrame,
@@ -39,7 +41,8 @@ def merge_data(
     Merges information from the three different data sources for
     this problem. This also checks that there's only the `ERROR`
     message level for each failure. If that's not the case, it
-    raises an error.
+    raises an error (lines with other levels can be quarantined while
+    parsing, see `shape_challenge.parsing.parse_failure_logs`).
 
     Args:
         dataframe_failure_logs (pd.DataFrame): DataFrame containing
@@ -83,7 +86,7 @@ def merge_data(
     """
     # Assert that all message levels are "ERROR". If that's the case, we can safely
     # remove the column.
-    assert dataframe_failure_logs["message_level"].unique() == ["ERROR"]
+    assert (dataframe_failure_logs["message_level"] == "ERROR").all()
     dataframe_failure_logs = dataframe_failure_logs.drop(
         "message_level", axis=1)
 
@@ -115,3 +118,32 @@ def merge_data(
     )
 
     return dataframe
+
+
+def merge_with_dimension_index(
+    dataframe_failure_logs: pd.DataFrame,
+    dimension_index: DimensionIndex,
+) -> pd.DataFrame:
+    """
+    Same as `merge_data`, but looks up the equipment information in a
+    `shape_challenge.dimensions.DimensionIndex` instead of merging the
+    equipment dataframes.
+
+    Args:
+        dataframe_failure_logs (pd.DataFrame): DataFrame containing
+            all failure events from the logs, as in `merge_data`.
+        dimension_index (DimensionIndex): The dimension index.
+
+    Returns:
+        A pandas dataframe with the merged data, with the same columns as
+        `merge_data`.
+
+    Raises:
+        AssertionError: If there's a failure with a different message
+            level than `ERROR`.
+    """
+    assert (dataframe_failure_logs["message_level"] == "ERROR").all()
+    dataframe = dataframe_failure_logs.drop("message_level", axis=1)
+    equipment = dimension_index.lookup(dataframe["sensor_id"].to_numpy())
+    equipment.index = dataframe.index
+    return pd.concat([dataframe, equipment], axis=1)
@@ -0,0 +1,231 @@
+"""
+Tests for `shape_challenge.delivery`, against a local HTTP stand-in for a
+Discord webhook.
+"""
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+from pathlib import Path
+import sys
+import threading
+import time
+from typing import List
+
+import pytest
+
+from shape_challenge.delivery import (
+    DISCORD_MAX_MESSAGE_SIZE,
+    ReportDispatcher,
+    Sink,
+    WebhookSink,
+    batch_messages,
+    split_message,
+)
+from shape_challenge.tasks import (
+    deliver_report,
+    flush_report_deliveries,
+)
+
+sys.path.insert(0, str(Path(__file__).parents[1] / "scripts"))
+
+
+class StandIn:
+    """
+    Local webhook that records the messages it receives. Every
+    `throttle_every`-th request is answered with `429` and a `Retry-After`.
+    """
+
+    def __init__(self, throttle_every: int = 0, retry_after: float = 0.1, latency: float = 0.0):
+        self.messages: List[str] = []
+        self.connections = set()
+        self.requests = 0
+        self.throttled = 0
+        lock = threading.Lock()
+        stand_in = self
+
+        class Handler(BaseHTTPRequestHandler):
+            """
+            Handles webhook requests.
+            """
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(self):  # pylint: disable=invalid-name
+                """
+                Records the message, or throttles the request.
+                """
+                body = self.rfile.read(int(self.headers["Content-Length"]))
+                time.sleep(latency)
+                with lock:
+                    stand_in.requests += 1
+                    stand_in.connections.add(self.client_address)
+                    throttle = throttle_every and stand_in.requests % throttle_every == 0
+                    if throttle:
+                        stand_in.throttled += 1
+                    else:
+                        stand_in.messages.append(json.loads(body)["content"])
+                if throttle:
+                    content = json.dumps({"retry_after": retry_after}).encode("utf-8")
+                    self.send_response(429)
+                    self.send_header("Retry-After", str(retry_after))
+                else:
+                    content = b""
+                    self.send_response(204)
+                self.send_header("Content-Length", str(len(content)))
+                self.end_headers()
+                self.wfile.write(content)
+
+            def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}/webhook"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def received(self) -> str:
+        """
+        The content of all the messages, without code block markers.
+        """
+        return "\n\n".join(message.strip("`") for message in self.messages)
+
+    def close(self):
+        """
+        Stops the stand-in.
+        """
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture(name="make_stand_in")
+def fixture_make_stand_in():
+    """
+    Creates stand-ins and stops them after the test.
+    """
+    stand_ins = []
+
+    def make_stand_in(**kwargs) -> StandIn:
+        stand_ins.append(StandIn(**kwargs))
+        return stand_ins[-1]
+
+    yield make_stand_in
+    for stand_in in stand_ins:
+        stand_in.close()
+
+
+def make_report(number: int) -> str:
+    """
+    Builds a report with the same shape as `generate_report`'s.
+    """
+    lines = [f"Report #{number}", "", "Total equipment failures: 11645"]
+    lines += [f"    GROUP{group:03d}: {1000 + 37 * group + number:.2f}" for group in range(8)]
+    return "\n".join(lines)
+
+
+def test_split_message_respects_max_size():
+    text = "\n".join(["a" * 5, "b" * 12, "", "c" * 3])
+    pieces = split_message(text, 6)
+    assert all(len(piece) <= 6 for piece in pieces)
+    assert "".join(pieces).replace("\n", "") == text.replace("\n", "")
+
+
+def test_batch_messages_packs_in_order():
+    assert batch_messages(["a", "b", "c"], 4) == ["a\n\nb", "c"]
+    assert batch_messages(["a", "b"]) == ["a\n\nb"]
+
+
+def test_dispatcher_batches_and_retries_on_429(make_stand_in):
+    stand_in = make_stand_in(throttle_every=3, latency=0.02)
+    reports = [make_report(number) for number in range(40)]
+    dispatcher = ReportDispatcher([WebhookSink(stand_in.url)], timeout=30.0)
+
+    start = time.perf_counter()
+    for report in reports:
+        dispatcher.submit(report)
+    blocked = time.perf_counter() - start
+    assert dispatcher.close()
+
+    assert blocked < 0.5
+    assert stand_in.throttled > 0
+    assert dispatcher.delivered == len(reports) and dispatcher.failed == 0
+    assert stand_in.received() == "\n\n".join(reports)
+    assert len(stand_in.messages) < len(reports)
+    assert all(len(message) <= DISCORD_MAX_MESSAGE_SIZE for message in stand_in.messages)
+    assert len(stand_in.connections) == 1
+
+
+def test_dispatcher_gives_up_after_timeout(make_stand_in):
+    stand_in = make_stand_in(throttle_every=1, retry_after=5.0)
+    dispatcher = ReportDispatcher([WebhookSink(stand_in.url)], timeout=0.5)
+    dispatcher.submit(make_report(0))
+
+    start = time.perf_counter()
+    assert dispatcher.close(timeout=2.0)
+    assert time.perf_counter() - start < 2.0
+    assert dispatcher.failed == 1 and dispatcher.delivered == 0
+    assert not stand_in.messages
+
+
+class BlockedSink(Sink):
+    """
+    Sink that waits for `release` before delivering.
+    """
+
+    def __init__(self):
+        self.release = threading.Event()
+        self.reports: List[str] = []
+
+    def deliver(self, reports: List[str], deadline: float = None) -> None:
+        self.release.wait()
+        self.reports += reports
+
+
+def test_sink_must_implement_deliver():
+    with pytest.raises(TypeError):
+        Sink()  # pylint: disable=abstract-class-instantiated
+
+
+def test_full_queue_is_counted_not_raised():
+    sink = BlockedSink()
+    dispatcher = ReportDispatcher([sink], timeout=0.3, max_queue_size=1)
+
+    submitted = [dispatcher.submit(make_report(number)) for number in range(3)]
+    sink.release.set()
+    assert dispatcher.close(timeout=5.0)
+
+    assert submitted == [True, True, False]
+    assert dispatcher.failed == 1 and dispatcher.delivered == 2
+    assert sink.reports == [make_report(0), make_report(1)]
+
+
+def test_deliver_report_is_flushed(make_stand_in, tmp_path):
+    stand_in = make_stand_in()
+    output_file = tmp_path / "reports" / "delivered.txt"
+    report = make_report(0)
+
+    sinks = deliver_report.run(report_text=report, sinks=[str(output_file)],
+                               discord_webhook_url=stand_in.url, timeout=10.0)
+    flush_report_deliveries.run(timeout=10.0)
+
+    assert sinks == 2
+    assert stand_in.received() == report
+    assert output_file.read_text(encoding="utf-8") == f"{report}\n\n"
+
+
+def test_flow_delivers_report(make_stand_in, tmp_path):
+    # pylint: disable=import-outside-toplevel
+    from generate_synthetic_data import generate
+    from shape_challenge.flows import flow
+
+    stand_in = make_stand_in(throttle_every=2)
+    parameters = generate(str(tmp_path), n_failures=2_000, n_equipment=20)
+    parameters.update({
+        "Start date": "2020-01-01",
+        "End date": "2020-01-31",
+        "Output report file path": str(tmp_path / "report.txt"),
+        "Discord webhook URL for report": stand_in.url,
+    })
+
+    state = flow.run(parameters=parameters)
+
+    assert state.is_successful()
+    assert stand_in.received() == (tmp_path / "report.txt").read_text(encoding="utf-8")
@@ -0,0 +1,72 @@
+"""
+Tests for `shape_challenge.server`.
+"""
+
+from pathlib import Path
+import sys
+
+import pytest
+
+from shape_challenge import server
+from shape_challenge.server import ReportDataset, ReportService
+
+sys.path.insert(0, str(Path(__file__).parents[1] / "scripts"))
+
+
+@pytest.fixture(name="paths")
+def fixture_paths(tmp_path):
+    """
+    A small synthetic dataset.
+    """
+    from generate_synthetic_data import generate  # pylint: disable=import-outside-toplevel
+    return generate(str(tmp_path), n_failures=5_000, n_equipment=20)
+
+
+def make_dataset(paths, tmp_path) -> ReportDataset:
+    """
+    Loads the synthetic dataset.
+    """
+    return ReportDataset(paths["Failure logs URL or path"],
+                         paths["Equipment data URL or path"],
+                         paths["Equipment-sensors relationship URL or path"],
+                         quarantine_path=str(tmp_path / "quarantine.tsv"))
+
+
+def test_refresh_reads_in_chunks(paths, tmp_path, monkeypatch):
+    expected = make_dataset(paths, tmp_path)
+    monkeypatch.setattr(server, "REFRESH_CHUNK_SIZE", 4096)
+    dataset = make_dataset(paths, tmp_path)
+
+    assert len(dataset) == len(expected) == 5_000
+    assert dataset.window("2020-01-01", "2020-02-01")[1].equals(
+        expected.window("2020-01-01", "2020-02-01")[1])
+
+
+def test_refresh_picks_up_appended_lines(paths, tmp_path, monkeypatch):
+    monkeypatch.setattr(server, "REFRESH_CHUNK_SIZE", 4096)
+    dataset = make_dataset(paths, tmp_path)
+    line = "[2020-02-01 00:00:00]\tERROR\tsensor[1]:\t(temperature\t1.0, vibration\t2.0)\n"
+
+    with open(paths["Failure logs URL or path"], "a", encoding="utf-8") as file:
+        file.write("not a failure log line\n" + line + line[:20])
+    assert dataset.refresh() == 1
+    assert dataset.quarantine.errors == 1
+
+    # The incomplete line is read once it's complete
+    with open(paths["Failure logs URL or path"], "a", encoding="utf-8") as file:
+        file.write(line[20:])
+    assert dataset.refresh() == 1
+    assert dataset.refresh() == 0
+    assert len(dataset) == 5_002
+    assert dataset.version == 3
+
+
+def test_cache_key_is_normalized(paths, tmp_path):
+    service = ReportService(make_dataset(paths, tmp_path))
+
+    report, hit = service.report("2020-01-01", "2020-01-15")
+    same_report, same_hit = service.report("2020-01-01 00:00:00", "2020-01-15T00:00:00")
+
+    assert not hit and same_hit
+    assert same_report == report
+    assert report["total_failures"] > 0
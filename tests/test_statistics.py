@@ -0,0 +1,101 @@
+"""
+Tests for `shape_challenge.statistics`.
+"""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from shape_challenge.statistics import (
+    QuantileSketch,
+    compute_measurement_statistics,
+)
+
+QUANTILES = (0.01, 0.05, 0.25, 0.5, 0.75, 0.95, 0.99)
+
+# Rank error allowed for the default capacity
+MAX_RANK_ERROR = 0.005
+
+
+def rank_error(sketch: QuantileSketch, values: np.ndarray) -> float:
+    """
+    Largest difference between the requested quantiles and the actual ranks
+    of the values the sketch returns for them.
+    """
+    ordered = np.sort(values)
+    return max(
+        abs(np.searchsorted(ordered, sketch.quantile(quantile), side="right")
+            / ordered.size - quantile)
+        for quantile in QUANTILES
+    )
+
+
+def make_values(kind: str, size: int) -> np.ndarray:
+    """
+    Values in the given order: i.i.d., drifting over time or sorted.
+    """
+    random = np.random.default_rng(7)
+    if kind == "iid":
+        return random.normal(size=size)
+    if kind == "drifting":
+        return np.linspace(0, 10, size) + random.normal(size=size)
+    if kind == "sorted":
+        return np.sort(random.normal(size=size))
+    return np.sort(random.normal(size=size))[::-1].copy()
+
+
+@pytest.mark.parametrize("kind", ["iid", "drifting", "sorted", "reversed"])
+@pytest.mark.parametrize("chunk_size", [1_000, 100_000])
+def test_sketch_matches_numpy_quantiles(kind, chunk_size):
+    values = make_values(kind, 1_000_000)
+    sketch = QuantileSketch()
+    for start in range(0, values.size, chunk_size):
+        sketch.update(values[start:start + chunk_size])
+
+    assert rank_error(sketch, values) < MAX_RANK_ERROR
+    assert sketch.quantile(0.5) == pytest.approx(np.quantile(values, 0.5), abs=0.05)
+    assert len(sketch) <= 3 * sketch.capacity
+
+
+def test_merged_sketches_match_numpy_quantiles():
+    values = make_values("drifting", 1_000_000)
+    merged = QuantileSketch()
+    for part in np.array_split(values, 16):
+        sketch = QuantileSketch()
+        sketch.update(part)
+        merged.merge(sketch)
+
+    assert rank_error(merged, values) < MAX_RANK_ERROR
+
+
+def test_sketch_is_exact_until_full():
+    values = make_values("iid", 500)
+    sketch = QuantileSketch()
+    sketch.update(values)
+
+    assert sketch.quantile(0.5) == np.sort(values)[249]
+    assert np.isnan(QuantileSketch().quantile(0.5))
+
+
+def test_measurement_statistics_match_pandas():
+    random = np.random.default_rng(3)
+    size = 200_000
+    dataframe = pd.DataFrame({
+        "group": random.choice(["A", "B", "C"], size=size),
+        "temperature": np.linspace(0, 100, size) + random.normal(size=size),
+        "vibration": random.normal(size=size),
+    })
+    dataframe.loc[random.choice(size, 1_000), "vibration"] = np.nan
+
+    chunks = (dataframe.iloc[start:start + 7_000] for start in range(0, size, 7_000))
+    statistics = compute_measurement_statistics(chunks, ["group"])["group"].to_frame()
+
+    expected = (dataframe.melt(id_vars="group", var_name="measurement").dropna()
+                .groupby(["group", "measurement"])["value"])
+    statistics = statistics.set_index(["group", "measurement"])
+    assert (statistics["count"] == expected.count()).all()
+    for column, reference in (("mean", expected.mean()), ("std", expected.std()),
+                              ("min", expected.min()), ("max", expected.max())):
+        np.testing.assert_allclose(statistics[column], reference, rtol=1e-9)
+    for column, quantile in (("p50", 0.5), ("p95", 0.95)):
+        np.testing.assert_allclose(statistics[column], expected.quantile(quantile), atol=0.5)